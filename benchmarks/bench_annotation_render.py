@@ -0,0 +1,55 @@
+# Micro-benchmark for the annotation renderer: per-image time against box count.
+# Run from the repository root:  python -m benchmarks.bench_annotation_render
+import os.path as osp
+import argparse
+import tempfile
+import time
+import numpy as np
+from PIL import Image
+
+from utils.annotation_utils import load_yolo_labels, render_annotations
+
+def write_labels(label_path, num_boxes, num_classes, rng):
+    boxes = np.column_stack([
+        rng.integers(0, num_classes, num_boxes),
+        rng.uniform(0.05, 0.95, (num_boxes, 2)),
+        rng.uniform(0.01, 0.1, (num_boxes, 2)),
+    ])
+    np.savetxt(label_path, boxes, fmt=["%d", "%.6f", "%.6f", "%.6f", "%.6f"])
+
+def main():
+    parser = argparse.ArgumentParser(description="Time render_annotations for increasing box counts")
+    parser.add_argument("--box-counts", type=int, nargs="+", default=[0, 10, 100, 500, 1000, 5000])
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--num-classes", type=int, default=20)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        image_path = osp.join(tmp_dir, "image.jpg")
+        Image.fromarray(rng.integers(0, 255, (args.height, args.width, 3), dtype=np.uint8)).save(image_path, quality=90)
+
+        print(f"{'boxes':>8} {'parse ms':>10} {'render ms':>10}")
+        for num_boxes in args.box_counts:
+            label_path = osp.join(tmp_dir, f"labels_{num_boxes}.txt")
+            write_labels(label_path, num_boxes, args.num_classes, rng)
+            # Untimed warm-up, font loading and cold file reads are not part of the per-render cost
+            render_annotations(image_path, label_path)
+
+            start = time.perf_counter()
+            for _ in range(args.repeats):
+                load_yolo_labels(label_path)
+            parse_ms = (time.perf_counter() - start) / args.repeats * 1000
+
+            start = time.perf_counter()
+            for _ in range(args.repeats):
+                render_annotations(image_path, label_path)
+            render_ms = (time.perf_counter() - start) / args.repeats * 1000
+
+            print(f"{num_boxes:>8} {parse_ms:>10.2f} {render_ms:>10.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+# Headless benchmark of the dashboards' core stages on a synthetic dataset.
+# Run from the repository root:
+#   python -m benchmarks.run --output bench_results.json
+#   python -m benchmarks.run --output new.json --compare old.json
+import os
+import os.path as osp
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+import numpy as np
+import cv2
+
+from benchmarks.synthetic import generate_images, generate_labels, generate_video
+from utils.image_displayer_utils import IMAGE_EXTENSIONS, prepare_thumbnail, make_thumbnail_bytes, create_executor
+from utils.annotation_utils import render_annotations, label_path_for
+from utils.thumbnail_cache import ThumbnailCache
+from utils.dir_scanner import DirectoryScanner
+from utils.mosaic import build_mosaics
+from utils.video_utils import FrameServer
+
+def summarize(durations):
+    # Durations in seconds to the per-stage record written to the JSON file
+    durations = np.asarray(durations, dtype=np.float64)
+    return {
+        "count": int(len(durations)),
+        "total_s": float(durations.sum()),
+        "mean_ms": float(durations.mean() * 1000) if len(durations) else 0.0,
+        "p50_ms": float(np.percentile(durations, 50) * 1000) if len(durations) else 0.0,
+        "p95_ms": float(np.percentile(durations, 95) * 1000) if len(durations) else 0.0,
+    }
+
+def time_calls(fn, items):
+    durations = []
+    for item in items:
+        start = time.perf_counter()
+        fn(item)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+def bench_scan(images_dir, work_dir):
+    scanner = DirectoryScanner(images_dir, osp.join(work_dir, "index"), IMAGE_EXTENSIONS, recursive=True)
+    cold = time_calls(lambda _: scanner.refresh(full=True), range(3))
+    warm = time_calls(lambda _: scanner.refresh(), range(10))
+    page = time_calls(lambda offset: scanner.page(offset, 100), range(0, max(1, scanner.count()), 100))
+    return {"scan_cold": summarize(cold), "scan_incremental": summarize(warm), "scan_page_query": summarize(page)}
+
+def bench_decode_resize(image_paths, max_edge):
+    return {
+        "decode_resize": summarize(time_calls(lambda path: prepare_thumbnail(path, max_edge=max_edge), image_paths)),
+        "decode_resize_encode": summarize(time_calls(lambda path: make_thumbnail_bytes(path, max_edge=max_edge), image_paths)),
+    }
+
+def bench_annotation_draw(image_paths, labels_dir, max_edge):
+    draw = lambda draw_at_display_size: lambda path: render_annotations(
+        path, label_path_for(path, labels_dir), max_edge=max_edge, draw_at_display_size=draw_at_display_size,
+    )
+    return {
+        "annotation_draw_full_size": summarize(time_calls(draw(False), image_paths)),
+        "annotation_draw_display_size": summarize(time_calls(draw(True), image_paths)),
+    }
+
+def bench_page_render(image_paths, work_dir, page_size, max_edge, num_workers, pool_type, tile_size):
+    # One page end to end as the grid does it: thumbnails on the pool, through the cache
+    executor = create_executor(num_workers, pool_type)
+    cache = ThumbnailCache(osp.join(work_dir, "thumbnails"), fmt="WEBP", quality=85)
+    pages = [image_paths[start:start + page_size] for start in range(0, len(image_paths), page_size)]
+
+    def render_page(page):
+        cells = []
+        futures = {}
+        for path in page:
+            key = cache.make_key(path, (None, None, max_edge))
+            data = cache.get(key)
+            if data is None:
+                futures[path] = (key, executor.submit(make_thumbnail_bytes, path, None, None, max_edge, cache.fmt, cache.quality))
+            cells.append(data)
+        for i, path in enumerate(page):
+            if path in futures:
+                key, future = futures[path]
+                cells[i] = future.result()
+                cache.put(key, cells[i])
+        return cells
+
+    try:
+        cold = time_calls(render_page, pages)
+        warm = time_calls(render_page, pages)
+        cells = render_page(pages[0])
+        mosaic = time_calls(lambda _: build_mosaics(executor, cells, pages[0], 10, tile_size, 25), range(3))
+    finally:
+        executor.shutdown()
+    return {"page_render_cold": summarize(cold), "page_render_cached": summarize(warm), "page_mosaic": summarize(mosaic)}
+
+def check_frame_server_recovery(video_path, frame_nums=(10, 30)):
+    # A read past the container's frame count fails and leaves the capture at EOF; frames
+    # served after it must still match a plain sequential decode
+    capture = cv2.VideoCapture(video_path)
+    expected = {}
+    for frame_num in range(max(frame_nums) + 1):
+        ok, frame = capture.read()
+        if frame_num in frame_nums:
+            expected[frame_num] = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    capture.release()
+
+    server = FrameServer(cv2.VideoCapture(video_path))
+    server.get_frame(server.total_frames + 5)
+    try:
+        for frame_num in frame_nums:
+            frame = server.get_frame(frame_num)
+            if frame is None or not np.array_equal(frame, expected[frame_num]):
+                raise RuntimeError(f"FrameServer served a wrong frame {frame_num} after a failed read")
+    finally:
+        server.release()
+
+def bench_video_seek(video_path, num_seeks, seed=0):
+    rng = np.random.default_rng(seed)
+    capture = cv2.VideoCapture(video_path)
+    total_frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    targets = rng.integers(0, total_frames, num_seeks).tolist()
+
+    def naive(frame_num):
+        # What the displayer did before the frame server: a keyframe seek per request
+        capture.set(cv2.CAP_PROP_POS_FRAMES, frame_num)
+        capture.read()
+    naive_random = time_calls(naive, targets)
+    capture.release()
+
+    server = FrameServer(cv2.VideoCapture(video_path))
+    random_seek = time_calls(server.get_frame, targets)
+    server.release()
+
+    # Stepping frame by frame, paced like a user holding an arrow key
+    server = FrameServer(cv2.VideoCapture(video_path))
+    def step(frame_num):
+        server.get_frame(frame_num)
+        time.sleep(0.005)
+    step_start = total_frames // 4
+    sequential = time_calls(step, range(step_start, min(total_frames, step_start + num_seeks)))
+    sequential = [d - 0.005 for d in sequential]
+    server.release()
+    return {
+        "video_seek_naive": summarize(naive_random),
+        "video_seek_random": summarize(random_seek),
+        "video_seek_sequential": summarize(sequential),
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_results(stages, baseline=None):
+    header = f"{'stage':<30} {'count':>6} {'mean ms':>10} {'p50 ms':>10} {'p95 ms':>10}"
+    print(header + (f" {'vs base':>8}" if baseline else ""))
+    for name, record in stages.items():
+        line = f"{name:<30} {record['count']:>6} {record['mean_ms']:>10.2f} {record['p50_ms']:>10.2f} {record['p95_ms']:>10.2f}"
+        if baseline:
+            base = baseline.get(name)
+            line += f" {record['mean_ms'] / base['mean_ms']:>7.2f}x" if base and base["mean_ms"] else f" {'-':>8}"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the dashboards' core stages on a synthetic dataset")
+    parser.add_argument("--output", default="bench_results.json", help="JSON file to write the results to")
+    parser.add_argument("--compare", help="Earlier results JSON to print ratios against")
+    parser.add_argument("--data-dir", help="Keep the synthetic dataset here (reused if present) instead of a temp dir")
+    parser.add_argument("--num-images", type=int, default=200)
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--subdirs", type=int, default=4)
+    parser.add_argument("--boxes-per-image", type=int, default=20)
+    parser.add_argument("--num-classes", type=int, default=80)
+    parser.add_argument("--video-frames", type=int, default=600)
+    parser.add_argument("--video-width", type=int, default=1280)
+    parser.add_argument("--video-height", type=int, default=720)
+    parser.add_argument("--num-seeks", type=int, default=60)
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--max-edge", type=int, default=1024)
+    parser.add_argument("--num-workers", type=int, default=0)
+    parser.add_argument("--pool-type", default="thread", choices=["thread", "process"])
+    parser.add_argument("--mosaic-tile-size", type=int, default=160)
+    parser.add_argument("--stages", nargs="+", default=["scan", "decode", "annotation", "page", "video"])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_dir = osp.abspath(args.data_dir) if args.data_dir else osp.join(tmp_dir, "data")
+        images_dir, labels_dir = osp.join(data_dir, "images"), osp.join(data_dir, "labels")
+        video_path = osp.join(data_dir, "video.mp4")
+
+        start = time.perf_counter()
+        if osp.isdir(images_dir):
+            image_paths = sorted(osp.join(d, f) for d, _, files in os.walk(images_dir) for f in files)
+        else:
+            image_paths = generate_images(images_dir, args.num_images, args.width, args.height, subdirs=args.subdirs)
+        if not osp.isdir(labels_dir):
+            # Labels sit flat next to the images, matching display_annotations' layout
+            generate_labels(labels_dir, image_paths, args.boxes_per_image, args.num_classes)
+        if "video" in args.stages and not osp.exists(video_path):
+            generate_video(video_path, args.video_frames, args.video_width, args.video_height)
+        print(f"Dataset ready in {time.perf_counter() - start:.1f}s: {data_dir}")
+
+        # Caches and indexes start empty on every run so cold numbers stay comparable
+        work_dir = osp.join(tmp_dir, "work")
+        stages = {}
+        if "scan" in args.stages:
+            stages.update(bench_scan(images_dir, work_dir))
+        if "decode" in args.stages:
+            stages.update(bench_decode_resize(image_paths, args.max_edge))
+        if "annotation" in args.stages:
+            stages.update(bench_annotation_draw(image_paths, labels_dir, args.max_edge))
+        if "page" in args.stages:
+            stages.update(bench_page_render(
+                image_paths, work_dir, args.page_size, args.max_edge, args.num_workers, args.pool_type, args.mosaic_tile_size,
+            ))
+        if "video" in args.stages:
+            check_frame_server_recovery(video_path)
+            stages.update(bench_video_seek(video_path, args.num_seeks))
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "params": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        },
+        "stages": stages,
+    }
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["stages"]
+    print_results(stages, baseline)
+    print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
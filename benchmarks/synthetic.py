@@ -0,0 +1,55 @@
+# Synthetic datasets for the benchmarks: image folders, YOLO label sets and encoded videos,
+# generated locally with PIL, NumPy and OpenCV.
+import os
+import os.path as osp
+import numpy as np
+import cv2
+from PIL import Image
+
+def _gradient_image(rng, width, height):
+    # Smooth content with some noise compresses like a photo, pure noise would not
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    phase = rng.uniform(0, 255, 3)
+    channels = [(x * rng.uniform(0.2, 1) + y * rng.uniform(0.2, 1) + p) % 256 for p in phase]
+    img = np.stack(channels, axis=2) + rng.normal(0, 8, (height, width, 3))
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+def generate_images(out_dir, count, width=1920, height=1080, fmt="jpg", subdirs=1, seed=0):
+    # `count` images spread over `subdirs` folders (1 keeps them flat), returns the paths
+    rng = np.random.default_rng(seed)
+    base = _gradient_image(rng, width, height)
+    paths = []
+    for i in range(count):
+        folder = out_dir if subdirs <= 1 else osp.join(out_dir, f"part_{i % subdirs:03d}")
+        os.makedirs(folder, exist_ok=True)
+        # Shift and tint a shared base so generation stays fast for large counts
+        img = np.roll(base, int(rng.integers(0, width)), axis=1) ^ np.uint8(i % 256)
+        path = osp.join(folder, f"image_{i:06d}.{fmt}")
+        Image.fromarray(img).save(path, quality=90) if fmt == "jpg" else Image.fromarray(img).save(path)
+        paths.append(path)
+    return paths
+
+def generate_labels(labels_dir, image_paths, boxes_per_image=20, num_classes=80, tiny_fraction=0.1, seed=0):
+    # One YOLO label file per image, box counts drawn around `boxes_per_image`
+    rng = np.random.default_rng(seed)
+    os.makedirs(labels_dir, exist_ok=True)
+    for image_path in image_paths:
+        num_boxes = int(rng.poisson(boxes_per_image))
+        sizes = np.where(rng.random((num_boxes, 1)) < tiny_fraction, rng.uniform(0.003, 0.015, (num_boxes, 2)), rng.uniform(0.02, 0.3, (num_boxes, 2)))
+        boxes = np.column_stack([rng.integers(0, num_classes, num_boxes), rng.uniform(0.05, 0.95, (num_boxes, 2)), sizes])
+        label_path = osp.join(labels_dir, osp.splitext(osp.basename(image_path))[0] + ".txt")
+        np.savetxt(label_path, boxes, fmt=["%d", "%.6f", "%.6f", "%.6f", "%.6f"])
+
+def generate_video(path, num_frames=300, width=1280, height=720, fps=30, seed=0):
+    # Moving gradient with the frame number burnt in, so decoded frames can be told apart
+    rng = np.random.default_rng(seed)
+    base = _gradient_image(rng, width, height)
+    os.makedirs(osp.dirname(osp.abspath(path)), exist_ok=True)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    for frame_num in range(num_frames):
+        frame = np.roll(base, frame_num * 8, axis=1).copy()
+        cv2.putText(frame, str(frame_num), (40, height // 2), cv2.FONT_HERSHEY_SIMPLEX, 4, (255, 255, 255), 8)
+        writer.write(frame)
+    writer.release()
+    return path
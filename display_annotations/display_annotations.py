@@ -1,22 +1,28 @@
 import os
-from math import ceil, sqrt
 import os.path as osp
-from PIL import ImageFile, Image, ImageDraw, ImageFont
+from PIL import ImageFile
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 import streamlit as st
-from natsort import natsorted
-import numpy as np
-import colorsys
 import yaml
 import sys
 import os
-import itertools
+import io
 
 # Get the absolute path to the root directory of your project
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.append(project_root)
 
 from utils.image_displayer_utils import *
+from utils.annotation_utils import render_grid_image, render_labelled_grid_image, label_path_for, load_label_names
+from utils.dir_scanner import DirectoryScanner
+from utils.annotation_index import AnnotationIndex
+from utils.mosaic import show_mosaic_page
+from utils.prefetch import PagePrefetcher, submit_cached
+from utils.thumbnail_cache import ThumbnailCache
+from utils.profiling import profiler, start_script_run, show_profiling_panel
+from utils.shards import ShardReader, is_shard_dir, INDEX_FILE
+from utils.coco_index import CocoIndex
+from utils.sort_keys import SortKeys, SORT_KEYS
 
 config_path = os.path.join(os.path.dirname(__file__), "config.yaml")
 with open(config_path, "r") as config_file:
@@ -29,164 +35,148 @@ st.set_page_config(
     page_icon="⭕️", 
 )
 
+# Timings are kept per session, other reviewers on the same server are not affected
+stage_profiler = start_script_run(config["profile_log_path"])
+
 st.image('sharingan.png', width=700)
 st.divider()
 
-# Initialize color mapping in session state if it doesn't exist
-if 'color_map' not in st.session_state:
-    st.session_state.color_map = {}
-if 'used_colors' not in st.session_state:
-    st.session_state.used_colors = []
-
-def color_distance(c1, c2):
-    return sqrt(sum((a - b) ** 2 for a, b in zip(c1, c2)))
-
-def is_similar(c1, c2, threshold=50):
-    return color_distance(c1, c2) < threshold
-
-def _generate_unique_bold_color():
-    max_attempts = 1000
-    np.random.seed(42)
-    for _ in range(max_attempts):
-        h = np.random.rand()
-        r, g, b = colorsys.hsv_to_rgb(h, 0.9, 1.0)
-        color = (int(r * 255), int(g * 255), int(b * 255))
-        if all(not is_similar(color, used) for used in st.session_state.used_colors):
-            st.session_state.used_colors.append(color)
-            return color
-    # Fallback if no distinct color found
-    fallback = tuple(np.random.randint(0, 255, 3))
-    st.session_state.used_colors.append(fallback)
-    return fallback
-
-def get_color_for_class(class_id):
-    if class_id in st.session_state.color_map:
-        return st.session_state.color_map[class_id]
-    color = _generate_unique_bold_color()
-    st.session_state.color_map[class_id] = color
-    return color
-
-def display_annotations_in_grid(images, num_columns=3, resize_dim=None, thumbnail_size=None):
-    if natural_sort:
-        natsorted(images)
-    else:
-        images.sort()
+@st.cache_resource
+def get_executor(num_workers, pool_type):
+    return create_executor(num_workers, pool_type)
+
+@st.cache_resource
+def get_render_cache(cache_dir, max_mb, fmt, quality):
+    return ThumbnailCache(cache_dir, max_bytes=max_mb * 1024 * 1024, fmt=fmt, quality=quality)
+
+executor = get_executor(config["num_workers"], config["pool_type"])
+render_cache = get_render_cache(
+    config["thumbnail_cache_dir"], config["thumbnail_cache_max_mb"],
+    config["thumbnail_format"], config["thumbnail_quality"],
+)
 
+if 'prefetcher' not in st.session_state:
+    st.session_state.prefetcher = PagePrefetcher(config["prefetch_pages"], config["prefetch_memory_mb"] * 1024 * 1024)
+
+@st.cache_resource
+def get_scanner(root):
+    return DirectoryScanner(root, config["index_dir"], ('.png', '.jpg', '.jpeg'))
+
+@st.cache_resource
+def get_annotation_index(labels_dir):
+    return AnnotationIndex(labels_dir, config["index_dir"])
+
+def class_name(class_id):
+    if label_names and 0 <= class_id < len(label_names):
+        return label_names[class_id]
+    return str(class_id)
+
+@st.cache_resource(max_entries=4)
+def get_coco_index(json_path, mtime):
+    return CocoIndex(json_path, config["index_dir"])
+
+@st.cache_resource
+def get_sort_keys(root):
+    return SortKeys()
+
+@st.cache_resource(max_entries=8)
+def get_shard_reader(shard_dir, index_mtime):
+    # Re-packing rewrites the index, which gives a new reader
+    return ShardReader(shard_dir)
+
+def annotation_submitter(resize_dim, thumbnail_size, max_edge, shard_reader=None, coco_index=None):
+    names_key = tuple(label_names) if label_names else None
+    settings = (names_key, resize_dim, thumbnail_size, max_edge, draw_at_display_size)
+
+    def submit(image_path):
+        # Rendered cells are sent to the browser as pre-encoded bytes and cached on disk,
+        # keyed on where the labels come from as well as on the image. Cache lookups run on the pool
+        render_args = (label_names, resize_dim, thumbnail_size, max_edge, draw_at_display_size, render_cache.fmt, render_cache.quality)
+        if shard_reader is not None:
+            # Packed images carry their labels, the pack's index stands in for both files
+            make_key = lambda: render_cache.make_key(shard_reader.index_path, (image_path, *settings))
+            def make_args():
+                image_data, label_data = shard_reader.read(image_path)
+                return (io.BytesIO(image_data), None if label_data is None else bytes(label_data), *render_args)
+            return submit_cached(executor, render_cache, make_key, render_labelled_grid_image, make_args)
+        if coco_index is not None:
+            # The box table directory is named after the annotation file's mtime and size.
+            # Only this image's rows of the box table are read
+            make_key = lambda: render_cache.make_key(image_path, (coco_index.index_dir, *settings))
+            make_args = lambda: (image_path, coco_index.labels_for(image_path), *render_args)
+            return submit_cached(executor, render_cache, make_key, render_labelled_grid_image, make_args)
+
+        def make_key():
+            label_path = label_path_for(image_path, labels_dir_path)
+            label_mtime = os.stat(label_path).st_mtime_ns if osp.exists(label_path) else None
+            return render_cache.make_key(image_path, (label_path, label_mtime, *settings))
+        return submit_cached(executor, render_cache, make_key, render_grid_image, lambda: (image_path, labels_dir_path, *render_args))
+    return submit
+
+def display_annotations_in_grid(images, num_columns=3, resize_dim=None, thumbnail_size=None, page=0, neighbours=None):
+    # Pages arrive in display order, sorting is done once over the whole listing
     num_columns = int(num_columns)
-    num_images = len(images)
-    num_rows = (num_images + num_columns - 1) // num_columns
-
-    for i in range(num_rows):
-        cols = st.columns(num_columns)
-        for j in range(num_columns):
-            image_index = i * num_columns + j
-            if image_index < num_images:
-                image_path = images[image_index]
-                image_name = osp.splitext(osp.basename(image_path))[0]
-                label_path = osp.join(labels_dir_path, image_name + ".txt")
-
-                img = Image.open(image_path).convert("RGB")
-                draw = ImageDraw.Draw(img)
-                img_width, img_height = img.size
-
-                thickness = max(1, img_height // 300)
-                font_size = max(10, img_height // 40)
-
-                try:
-                    font = ImageFont.truetype("arial.ttf", font_size)
-                except:
-                    font = ImageFont.load_default()
-
-                if osp.exists(label_path):
-                    with open(label_path, 'r') as f:
-                        for line in f:
-                            parts = line.strip().split()
-                            if len(parts) != 5:
-                                continue
-                            cls_id, x_center, y_center, width, height = map(float, parts)
-                            x1 = int((x_center - width / 2) * img_width)
-                            y1 = int((y_center - height / 2) * img_height)
-                            x2 = int((x_center + width / 2) * img_width)
-                            y2 = int((y_center + height / 2) * img_height)
-
-                            color = get_color_for_class(int(cls_id))
-                            draw.rectangle([x1, y1, x2, y2], outline=color, width=thickness)
-
-                            # Determine label text
-                            if label_names and 0 <= int(cls_id) < len(label_names):
-                                label = label_names[int(cls_id)]
-                            else:
-                                label = str(int(cls_id))
-
-                            text_bbox = font.getbbox(label)
-                            text_width = text_bbox[2] - text_bbox[0]
-                            text_height = text_bbox[3] - text_bbox[1]
-
-                            # Label box background
-                            label_bg = [x1, y1, x1 + text_width + 6, y1 + text_height + 4]
-                            draw.rectangle(label_bg, fill=color)
-                            draw.text((x1 + 3, y1 + 2), label, fill="white", font=font)
-                else:
-                    text = "NO LABELS FOUND"
-                    font_size = max(20, img_height // 15)  # Font size is proportional to image height (you can adjust the divisor for your liking)
-                    try:
-                        font = ImageFont.truetype("arial.ttf", font_size)
-                    except:
-                        font = ImageFont.load_default()
-
-                    text_bbox = font.getbbox(text)
-                    text_width = text_bbox[2] - text_bbox[0]
-                    text_height = text_bbox[3] - text_bbox[1]
-
-                    box_x = (img_width - text_width) // 2
-                    box_y = 10
-                    box_padding = 10  # Increased padding for better readability
-                    box_coords = [
-                        (box_x - box_padding, box_y - box_padding),
-                        (box_x + text_width + box_padding, box_y + text_height + box_padding)
-                    ]
-
-                    draw.rectangle(box_coords, fill=(139, 0, 0))  # Dark red background
-                    draw.text((box_x, box_y), text, fill="white", font=font)
-
-                if resize_dim:
-                    img = img.resize(resize_dim, Image.Resampling.LANCZOS)
-                if thumbnail_size:
-                    img.thumbnail((thumbnail_size, thumbnail_size))
-
-                if use_original_img_width:
-                    cols[j].image(img, width=img.width, caption=osp.basename(image_path))
-                else:
-                    cols[j].image(img, use_container_width=True, caption=osp.basename(image_path))
+
+    # Original width shows every pixel, otherwise the column width bounds the display size
+    max_edge = None if use_original_img_width else config["display_max_edge"]
+
+    # Neighbouring pages were (or are being) rendered in the background while this one was shown
+    prefetcher = st.session_state.prefetcher
+    prefetcher.configure((
+        st.session_state.folder_path, labels_dir_path, yaml_path, resize_dim, thumbnail_size, max_edge, draw_at_display_size,
+    ))
+    prefetcher.focus(page)
+    submit = annotation_submitter(resize_dim, thumbnail_size, max_edge, shard_reader, coco_index)
+    futures = prefetcher.get_page(page, images, submit)
+
+    def show(cell, image_index, img):
+        if use_original_img_width:
+            cell.image(img, use_container_width=False, caption=osp.basename(images[image_index]))
+        else:
+            cell.image(img, use_container_width=True, caption=osp.basename(images[image_index]))
+
+    if mosaic_mode:
+        page_bytes = show_mosaic_page(
+            executor, futures, images, num_columns, config["mosaic_tile_size"], config["mosaic_rows_per_image"], prefetcher.settings_key,
+            render_cache.fmt, render_cache.quality,
+        )
+    else:
+        cells = create_grid_cells(len(images), num_columns)
+        fill_grid_cells(cells, futures, show)
+        page_bytes = sum(len(f.result()) for f in futures)
+    cache_stats = render_cache.stats()
+    st.caption(
+        f"Page transfer: {page_bytes / 1e6:.1f} MB {render_cache.fmt} · "
+        f"render cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses, {cache_stats['bytes'] / 1e6:.1f} MB"
+    )
+
+    prefetcher.prefetch(page, neighbours or {}, submit)
 
 
 # Sidebar Inputs
 imgs_dir_path = st.sidebar.text_input("Input Images Directory Path")
-labels_dir_path = st.sidebar.text_input("Input Labels Directory Path (optional)")
+labels_dir_path = st.sidebar.text_input("Input Labels Directory Path (optional)", help="A YOLO labels directory, or a COCO annotations .json file.")
 yaml_path = st.sidebar.text_input("Input dataset.yaml path (optional)")
 
 label_names = None
 if yaml_path:
     if osp.exists(yaml_path):
         try:
-            with open(yaml_path, 'r') as yf:
-                yaml_dict = yaml.safe_load(yf)
-                label_names = yaml_dict.get('names', None)
-                if not isinstance(label_names, (list, tuple)):
-                    st.sidebar.error('Invalid "names" format in YAML; expected a list.')
-                    label_names = None
+            label_names = load_label_names(yaml_path)
+        except ValueError as e:
+            st.sidebar.error(str(e))
         except Exception as e:
             st.sidebar.error(f"Error loading YAML: {e}")
             label_names = None
     else:
         st.sidebar.error(f"YAML file not found: {yaml_path}")
 
-natural_sort = False
-if config["natural_sort"]:
-    natural_sort = st.sidebar.toggle('Natural Sort')
-    st.sidebar.info("Natural sorting is the ordering of strings in alphabetical order,\nexcept that multi-digit numbers are treated atomically, i.e., as if they were a single character.")
+sort_order = sort_controls(SORT_KEYS, config["sort_by"])
 
 use_original_img_width = st.sidebar.toggle('Original Image Width')
+mosaic_mode = st.sidebar.toggle('Mosaic Page Mode', help="Compose each page into a few large images, for dense overview pages.")
+draw_at_display_size = st.sidebar.toggle('Draw on Display-Size Image', value=config["draw_at_display_size"], disabled=use_original_img_width,
+                                         help="Downscale first, then draw the boxes. Much cheaper for large images, labels are sized for the grid.")
 resize_dim = None 
 thumbnail_size = None
     
@@ -206,7 +196,9 @@ if not use_original_img_width:
     else:
         resize_dim = None
 
-if not labels_dir_path:
+if is_shard_dir(imgs_dir_path):
+    st.sidebar.write("Packed dataset: labels are read from the shards, annotation filters are off.")
+elif not labels_dir_path:
     labels_dir_path = osp.join(imgs_dir_path, "..", "labels")
     st.sidebar.write(f"Derived Labels Directory Path: {labels_dir_path}")
 
@@ -216,63 +208,111 @@ if not (os.path.exists(imgs_dir_path) and os.path.isdir(imgs_dir_path)):
     st.error(f"Images directory path is wrong or isn't directory: {imgs_dir_path}")
 
 else:
-    all_imgs = []
-    for img_file_pth in os.listdir(st.session_state.folder_path):
-        if img_file_pth.lower().endswith(('.png', '.jpg', '.jpeg')):
-            all_imgs.append(os.path.join(st.session_state.folder_path, img_file_pth))
-
-    if len(all_imgs) == 0:
+    # The listing is indexed on disk, reruns only re-list the directory if it changed.
+    # A packed dataset (see pack_dataset.py) lists and reads images and labels from the shards
+    shard_reader = None
+    coco_index = None
+    if is_shard_dir(imgs_dir_path):
+        shard_reader = get_shard_reader(imgs_dir_path, os.path.getmtime(os.path.join(imgs_dir_path, INDEX_FILE)))
+        scanner = shard_reader
+        annotation_index = None
+    elif labels_dir_path.lower().endswith(".json") and osp.isfile(labels_dir_path):
+        # COCO annotations are streamed once into a per-image box table, reruns only open it
+        scanner = get_scanner(st.session_state.folder_path)
+        coco_index = get_coco_index(labels_dir_path, os.path.getmtime(labels_dir_path))
+        if not coco_index.is_built():
+            progress_bar = st.progress(0.0, text="Indexing COCO annotations, once per file...")
+            coco_index.build(lambda done, total: progress_bar.progress(min(1.0, done / max(total, 1)), text=f"Indexing COCO annotations, once per file... {done / 1e6:.0f}/{total / 1e6:.0f} MB"))
+            progress_bar.empty()
+        if label_names is None:
+            label_names = coco_index.category_names
+        annotation_index = None
+    else:
+        scanner = get_scanner(st.session_state.folder_path)
+        annotation_index = get_annotation_index(labels_dir_path) if osp.isdir(labels_dir_path) else None
+    if st.sidebar.button("🔄 Rescan Directory"):
+        # A file rewritten in place keeps its directory's mtime, the manual rescan re-lists everything
+        scanner.refresh(full=True)
+        if annotation_index:
+            annotation_index.refresh(executor)
+    else:
+        scanner.refresh_if_stale(config["rescan_interval_s"])
+        if annotation_index:
+            annotation_index.refresh_if_stale(config["rescan_interval_s"], executor)
+    num_imgs = scanner.count()
+
+    # Other orders than the listing's own and filters work on the listing's rows: the listing
+    # and its sort keys are loaded once per rescan, reruns only permute rows
+    sort_keys = get_sort_keys(st.session_state.folder_path)
+    if shard_reader is not None and any(key in ("dimensions", "boxes") for key, _ in sort_order):
+        st.sidebar.warning("Images in packed datasets are not sorted by dimensions or box count.")
+        sort_order = [(key, descending) for key, descending in sort_order if key not in ("dimensions", "boxes")] or [("name", False)]
+    if any(key == "boxes" for key, _ in sort_order) and not (annotation_index or coco_index):
+        st.sidebar.warning("Box counts need a labels directory or COCO annotations file.")
+        sort_order = [(key, descending) for key, descending in sort_order if key != "boxes"] or [("name", False)]
+
+    # Filters run on the label index, so no label file is opened to decide what is shown
+    filtered_imgs = None
+    if annotation_index and num_imgs:
+        with st.sidebar.expander("🔎 Filter by Annotations"):
+            class_stats = annotation_index.class_stats()
+            selected_classes = st.multiselect(
+                "Classes", list(class_stats),
+                format_func=lambda class_id: f"{class_name(class_id)} ({class_stats[class_id][0]} images)",
+            )
+            max_count = int(annotation_index.box_counts.max()) if len(annotation_index.box_counts) else 0
+            min_boxes, max_boxes = st.slider("Boxes per image", 0, max(1, max_count), (0, max(1, max_count)))
+            tiny_only = st.toggle("Only images with tiny boxes")
+            if st.toggle("Show class statistics"):
+                st.dataframe(
+                    [{"class": class_name(c), "images": i, "boxes": b} for c, (i, b) in class_stats.items()],
+                    hide_index=True,
+                )
+        if selected_classes or tiny_only or min_boxes > 0 or max_boxes < max_count:
+            with profiler.stage("annotation filter"):
+                sort_keys.update(scanner)
+                filtered_imgs = annotation_index.filter_images(sort_keys.paths, selected_classes, min_boxes, max_boxes, tiny_only)
+            st.sidebar.write("Matching images:", len(filtered_imgs))
+
+    if num_imgs == 0:
         st.error(f"No images found in: {imgs_dir_path}")
     
     else:
-        st.sidebar.write("Total images:", len(all_imgs))
-        num_columns = st.sidebar.number_input("No. of images per row", min_value=1, max_value=10, value = config["num_columns"])
+        st.sidebar.write("Total images:", num_imgs)
         imgs_per_page = st.sidebar.number_input("No. of images per page", min_value=50, max_value=1000, value = config["imgs_per_page"], step = 50)
-        all_imgs.sort()
-
-        # Initialize the current page in session state if it doesn't exist
-        if 'current_page' not in st.session_state:
-            st.session_state.current_page = 0
-            
-        # Calculate total pages
-        total_pages = ceil(len(all_imgs)/imgs_per_page)
-        
-        # Get current page from paginator and update session state
-        location = st.sidebar.empty()
-        page_format_func = lambda i: f"Page {i+1}"
-        st.session_state.current_page = location.selectbox(
-            f"Select a page from < **{total_pages}** > pages", 
-            range(total_pages), 
-            index=st.session_state.current_page,
-            format_func=page_format_func,
-            key="page_selector"
+
+        shown_rows = None
+        if sort_order != [("name", False)] or filtered_imgs is not None:
+            sort_keys.update(scanner)
+            if any(key == "boxes" for key, _ in sort_order):
+                # Box counts come from the label index or the COCO box table, no label file is opened
+                box_source = annotation_index or coco_index
+                sort_keys.set_key("boxes", box_source.box_counts_for(sort_keys.paths), version=(id(box_source), getattr(box_source, "last_refresh", None)))
+            with st.spinner("Sorting images..."):
+                if filtered_imgs is None:
+                    shown_rows = sort_keys.order(sort_order, executor)
+                else:
+                    shown_rows = sort_keys.sort_rows(sort_keys.rows_of(filtered_imgs), sort_order, executor)
+
+        # Get images for a page, from the directory index or the sorted/filtered rows
+        num_shown = num_imgs if shown_rows is None else len(shown_rows)
+        page_images = lambda page: (
+            scanner.page(page * imgs_per_page, imgs_per_page) if shown_rows is None
+            else [sort_keys.paths[row] for row in shown_rows[page * imgs_per_page:(page + 1) * imgs_per_page]]
         )
-        
-        # Get images for current page
-        min_index = st.session_state.current_page * imgs_per_page
-        max_index = min_index + imgs_per_page
-        image_iterator = list(itertools.islice(enumerate(all_imgs), min_index, max_index))
-        
-        indices_on_page, images_on_page = map(list, zip(*image_iterator)) if image_iterator else ([], [])
-        
-        # Display images
-        display_annotations_in_grid(images_on_page, num_columns, resize_dim, thumbnail_size)
-
-        # Add pagination buttons at the bottom
-        st.sidebar.write("Current Page:", st.session_state.current_page + 1)
-        
-        # Next/Previous buttons at the bottom of page
-        left_col, middle_col, right_col = st.columns([1, 10, 1])
-        
-        # Previous button on left
-        if left_col.button("⬅️ Previous Page", disabled=(st.session_state.current_page <= 0)):
-            st.session_state.current_page = max(0, st.session_state.current_page - 1)
-            st.rerun()
-            
-        # Next button on right
-        if right_col.button("➡️ Next Page", disabled=(st.session_state.current_page >= total_pages - 1)):
-            st.session_state.current_page = min(total_pages - 1, st.session_state.current_page + 1)
-            st.rerun()
+
+        # Paging and column changes only rerun the grid fragment, not the scan, index and sidebar
+        paginated_grid(
+            num_shown, imgs_per_page, page_images,
+            lambda images, num_columns, page, neighbours: display_annotations_in_grid(images, num_columns, resize_dim, thumbnail_size, page, neighbours),
+            config["num_columns"], config["prefetch_pages"],
+        )
+
+st.sidebar.divider()
+st.sidebar.toggle("Profile Stages", key="profile_stages", help="Time each stage of a run: scan, decode, resize, drawing, encoding, transfer.")
+stage_profiler.end_run()
+if stage_profiler.enabled:
+    show_profiling_panel(stage_profiler)
 
 if __name__ == "__main__":
     pass
\ No newline at end of file
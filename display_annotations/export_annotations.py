@@ -0,0 +1,157 @@
+# Headless batch export of annotated images and per-directory contact sheets.
+#   python display_annotations/export_annotations.py --images data/images --out export --mode both
+# Re-running the same command resumes: finished outputs newer than their image and label are skipped.
+import os
+import os.path as osp
+import sys
+import time
+import argparse
+from concurrent.futures import wait, FIRST_COMPLETED
+
+# Get the absolute path to the root directory of your project
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(project_root)
+
+from utils.image_displayer_utils import create_executor
+from utils.annotation_utils import label_path_for, load_label_names
+from utils.batch_export import FORMAT_EXTENSIONS, export_annotated_chunk, export_contact_sheet, is_up_to_date, is_sheet_done
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+def list_images(images_dir, recursive=False):
+    # {directory relative to images_dir: sorted image paths}
+    groups = {}
+    for dir_path, dir_names, file_names in os.walk(images_dir):
+        dir_names.sort()
+        images = sorted(osp.join(dir_path, name) for name in file_names if name.lower().endswith(IMAGE_EXTENSIONS))
+        if images:
+            groups[osp.relpath(dir_path, images_dir)] = images
+        if not recursive:
+            break
+    return groups
+
+def plan_annotated(groups, labels_dir, out_dir, ext, chunk_size):
+    # Chunks of (image_path, output_path) still to render, and the number already up to date
+    pending, skipped = [], 0
+    for rel_dir, images in groups.items():
+        for image_path in images:
+            output_path = osp.normpath(osp.join(out_dir, "annotated", rel_dir, osp.splitext(osp.basename(image_path))[0] + ext))
+            if is_up_to_date(output_path, (image_path, label_path_for(image_path, labels_dir))):
+                skipped += 1
+            else:
+                pending.append((image_path, output_path))
+    return [pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size)], skipped
+
+def plan_sheets(groups, labels_dir, out_dir, ext, images_per_sheet):
+    # (image_paths, sheet_path) per sheet still to compose, and the number of images on finished sheets
+    pending, skipped = [], 0
+    for rel_dir, images in groups.items():
+        for sheet_number, start in enumerate(range(0, len(images), images_per_sheet), start=1):
+            sheet_images = images[start:start + images_per_sheet]
+            sheet_path = osp.normpath(osp.join(out_dir, "sheets", rel_dir, f"sheet_{sheet_number:04d}{ext}"))
+            if is_sheet_done(sheet_images, sheet_path, labels_dir):
+                skipped += len(sheet_images)
+            else:
+                pending.append((sheet_images, sheet_path))
+    return pending, skipped
+
+def run_tasks(executor, tasks, max_in_flight, total, label):
+    # Keeps at most max_in_flight tasks queued, so results and pending pickles stay bounded.
+    # `tasks` yields (num_images, fn, args); progress and throughput go to stderr
+    tasks = iter(tasks)
+    in_flight = {}
+    done, failures = 0, []
+    start = last_report = time.perf_counter()
+
+    def report(final=False):
+        elapsed = time.perf_counter() - start
+        rate = done / elapsed if elapsed > 0 else 0.0
+        eta = (total - done) / rate if rate > 0 else 0.0
+        if final:
+            sys.stderr.write(f"\r{label}: {done} images in {elapsed:.1f}s, {rate:.1f} img/s, {len(failures)} failed\n")
+        else:
+            sys.stderr.write(f"\r{label}: {done}/{total} images · {rate:.1f} img/s · ETA {eta:.0f}s   ")
+        sys.stderr.flush()
+
+    while True:
+        while len(in_flight) < max_in_flight:
+            task = next(tasks, None)
+            if task is None:
+                break
+            num_images, fn, args = task
+            in_flight[executor.submit(fn, *args)] = num_images
+        if not in_flight:
+            break
+        finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+        for future in finished:
+            num_images = in_flight.pop(future)
+            try:
+                _, failed = future.result()
+            except Exception as e:
+                failed = [(f"<task of {num_images} images>", str(e))]
+            done += num_images
+            failures.extend(failed)
+        if time.perf_counter() - last_report > 1:
+            report()
+            last_report = time.perf_counter()
+    report(final=True)
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description="Export annotated images and contact sheets without the UI")
+    parser.add_argument("--images", required=True, help="Images directory")
+    parser.add_argument("--labels", help="YOLO labels directory, defaults to <images>/../labels like the dashboard")
+    parser.add_argument("--yaml", help="dataset.yaml with the class names")
+    parser.add_argument("--out", required=True, help="Output directory, gets annotated/ and sheets/ subdirectories")
+    parser.add_argument("--mode", choices=["images", "sheets", "both"], default="both")
+    parser.add_argument("--recursive", action="store_true", help="Include subdirectories, one set of sheets per directory")
+    parser.add_argument("--max-edge", type=int, default=None, help="Longest edge of annotated images, full resolution by default")
+    parser.add_argument("--draw-at-display-size", action="store_true", help="Downscale to --max-edge before drawing the boxes")
+    parser.add_argument("--format", choices=sorted(FORMAT_EXTENSIONS), default="JPEG")
+    parser.add_argument("--quality", type=int, default=90)
+    parser.add_argument("--sheet-columns", type=int, default=8)
+    parser.add_argument("--sheet-rows", type=int, default=8)
+    parser.add_argument("--tile-size", type=int, default=256)
+    parser.add_argument("--num-workers", type=int, default=0, help="Worker processes, 0 uses one per CPU core")
+    parser.add_argument("--chunk-size", type=int, default=16, help="Images per work item")
+    args = parser.parse_args()
+
+    labels_dir = args.labels or osp.join(args.images, "..", "labels")
+    label_names = load_label_names(args.yaml) if args.yaml else None
+    ext = FORMAT_EXTENSIONS[args.format]
+
+    groups = list_images(args.images, args.recursive)
+    num_images = sum(len(images) for images in groups.values())
+    print(f"{num_images} images in {len(groups)} directories, labels from {labels_dir}")
+    if not num_images:
+        return 1
+
+    num_workers = args.num_workers if args.num_workers > 0 else (os.cpu_count() or 1)
+    executor = create_executor(num_workers, "process")
+    max_in_flight = 2 * num_workers
+    failures = []
+    try:
+        if args.mode in ("images", "both"):
+            chunks, skipped = plan_annotated(groups, labels_dir, args.out, ext, args.chunk_size)
+            print(f"Annotated images: {skipped} up to date, {sum(len(c) for c in chunks)} to render")
+            failures += run_tasks(executor, (
+                (len(chunk), export_annotated_chunk, (chunk, labels_dir, label_names, args.max_edge, args.draw_at_display_size, args.format, args.quality))
+                for chunk in chunks
+            ), max_in_flight, sum(len(c) for c in chunks), "annotated")
+
+        if args.mode in ("sheets", "both"):
+            sheets, skipped = plan_sheets(groups, labels_dir, args.out, ext, args.sheet_columns * args.sheet_rows)
+            print(f"Contact sheets: {skipped} images on finished sheets, {len(sheets)} sheets to compose")
+            failures += run_tasks(executor, (
+                (len(images), export_contact_sheet, (images, sheet_path, labels_dir, label_names, args.sheet_columns, args.tile_size, args.format, args.quality))
+                for images, sheet_path in sheets
+            ), max_in_flight, sum(len(images) for images, _ in sheets), "sheets")
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+    for image_path, error in failures:
+        print(f"Failed: {image_path}: {error}", file=sys.stderr)
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
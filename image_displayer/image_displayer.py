@@ -1,20 +1,27 @@
 import os
-from math import ceil
 import os.path as osp
-from PIL import ImageFile,Image
+from PIL import ImageFile
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 import streamlit as st
-from natsort import natsorted
 import yaml
 import sys
 import os
-import itertools
+import io
+import numpy as np
 
 # Get the absolute path to the root directory of your project
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.append(project_root)
 
 from utils.image_displayer_utils import *
+from utils.thumbnail_cache import ThumbnailCache
+from utils.dir_scanner import DirectoryScanner
+from utils.mosaic import show_mosaic_page
+from utils.prefetch import PagePrefetcher, submit_cached
+from utils.profiling import profiler, start_script_run, show_profiling_panel
+from utils.shards import ShardReader, is_shard_dir, INDEX_FILE
+from utils.phash_index import HashIndex
+from utils.sort_keys import SortKeys, SORT_KEYS
 
 config_path = os.path.join(os.path.dirname(__file__), "config.yaml")
 with open(config_path, "r") as config_file:
@@ -27,43 +34,110 @@ st.set_page_config(
     page_icon="⭕️",
 )
 
+# Timings are kept per session, other reviewers on the same server are not affected
+stage_profiler = start_script_run(config["profile_log_path"])
+
 st.image('sharingan.png', width=700)
 st.divider()
 
+@st.cache_resource
+def get_thumbnail_cache(cache_dir, max_mb, fmt, quality):
+    return ThumbnailCache(cache_dir, max_bytes=max_mb * 1024 * 1024, fmt=fmt, quality=quality)
+
+@st.cache_resource
+def get_executor(num_workers, pool_type):
+    return create_executor(num_workers, pool_type)
+
+thumbnail_cache = get_thumbnail_cache(
+    config["thumbnail_cache_dir"], config["thumbnail_cache_max_mb"],
+    config["thumbnail_format"], config["thumbnail_quality"],
+)
+executor = get_executor(config["num_workers"], config["pool_type"])
+
+if 'prefetcher' not in st.session_state:
+    st.session_state.prefetcher = PagePrefetcher(config["prefetch_pages"], config["prefetch_memory_mb"] * 1024 * 1024)
+
+@st.cache_resource
+def get_scanner(root, recursive):
+    extensions = IMAGE_EXTENSIONS if recursive else ('.png', '.jpg', '.jpeg')
+    return DirectoryScanner(root, config["index_dir"], extensions, recursive)
+
+@st.cache_resource
+def get_hash_index(root, recursive):
+    return HashIndex(root, config["index_dir"], recursive)
+
+@st.cache_resource
+def get_sort_keys(root, recursive):
+    return SortKeys()
+
+@st.cache_resource(max_entries=8)
+def get_shard_reader(shard_dir, index_mtime):
+    # Re-packing rewrites the index, which gives a new reader
+    return ShardReader(shard_dir)
+
+def thumbnail_submitter(resize_dim, thumbnail_size, shard_reader=None):
+    max_edge = config["thumbnail_max_edge"]
+    target = (resize_dim, thumbnail_size, max_edge)
+
+    def submit(image_path):
+        # Cache lookups and misses (decode and resize) both run on the pool
+        if shard_reader is not None:
+            # Packed images have no file of their own, the pack's index stands in for it
+            make_key = lambda: thumbnail_cache.make_key(shard_reader.index_path, (image_path, target))
+            source = lambda: io.BytesIO(shard_reader.read(image_path)[0])
+        else:
+            make_key = lambda: thumbnail_cache.make_key(image_path, target)
+            source = lambda: image_path
+        return submit_cached(
+            executor, thumbnail_cache, make_key, make_thumbnail_bytes,
+            lambda: (source(), resize_dim, thumbnail_size, max_edge, thumbnail_cache.fmt, thumbnail_cache.quality),
+        )
+    return submit
+
 # @st.cache_data(show_spinner=True)
-def display_images_in_grid(images, num_columns = 3, resize_dim = None, thumbnail_size = None):
-    
-    if natural_sort:
-        natsorted(images)
-    else:
-        images.sort()
-    
+def display_images_in_grid(images, num_columns = 3, resize_dim = None, thumbnail_size = None, page = 0, neighbours = None, similar_counts = None):
+    # Pages arrive in display order, sorting is done once over the whole listing
     num_columns = int(num_columns)
-    num_images = len(images)
-    num_rows = (num_images + num_columns - 1) // num_columns
-
-    for i in range(num_rows):
-        cols = st.columns(num_columns)
-        for j in range(num_columns):
-            image_index = i * num_columns + j
-            if image_index < num_images:
-                image_path = images[image_index]
-                img = Image.open(image_path)
-                if resize_dim:
-                    img = img.resize(resize_dim, Image.Resampling.LANCZOS)
-                if thumbnail_size:
-                    img.thumbnail((thumbnail_size, thumbnail_size))
-                # cols[j].image(img, use_column_width=True, caption=osp.basename(image_path))
-                cols[j].image(img, use_container_width=True, caption=osp.basename(image_path)) # to supress warning
+
+    # Neighbouring pages were (or are being) prepared in the background while this one was shown
+    prefetcher = st.session_state.prefetcher
+    prefetcher.configure((st.session_state.folder_path, rescursive_search, resize_dim, thumbnail_size))
+    prefetcher.focus(page)
+    submit = thumbnail_submitter(resize_dim, thumbnail_size, shard_reader)
+    futures = prefetcher.get_page(page, images, submit)
+
+    if mosaic_mode:
+        page_bytes = show_mosaic_page(
+            executor, futures, images, num_columns, config["mosaic_tile_size"], config["mosaic_rows_per_image"], prefetcher.settings_key,
+            thumbnail_cache.fmt, thumbnail_cache.quality,
+        )
+    else:
+        cells = create_grid_cells(len(images), num_columns)
+        # cols[j].image(img, use_column_width=True, caption=osp.basename(image_path))
+        similar_counts = similar_counts or {}
+        caption = lambda image_path: osp.basename(image_path) + (f" (+{similar_counts[image_path]} similar)" if similar_counts.get(image_path) else "")
+        show = lambda cell, image_index, img: cell.image(img, use_container_width=True, caption=caption(images[image_index])) # to supress warning
+        fill_grid_cells(cells, futures, show)
+        page_bytes = sum(len(f.result()) for f in futures)
+    cache_stats = thumbnail_cache.stats()
+    st.caption(
+        f"Page transfer: {page_bytes / 1e6:.1f} MB {thumbnail_cache.fmt} · "
+        f"thumbnail cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses, {cache_stats['bytes'] / 1e6:.1f} MB"
+    )
+
+    prefetcher.prefetch(page, neighbours or {}, submit)
 
 imgs_dir_path = st.sidebar.text_input("Input Images Directory Path")
 rescursive_search = st.sidebar.toggle('Recursive Search')
+mosaic_mode = st.sidebar.toggle('Mosaic Page Mode', help="Compose each page into a few large images, for dense overview pages.")
+DEDUP_ALL, DEDUP_ONE, DEDUP_GROUPED = "Show all", "One per cluster", "Duplicates only, grouped"
+dedup_mode = st.sidebar.selectbox(
+    "Near-Duplicates", [DEDUP_ALL, DEDUP_ONE, DEDUP_GROUPED],
+    help="Group visually similar images by perceptual hash. Hashing runs in the background the first time a directory is opened.",
+)
 
 ########################################################################
-natural_sort = False
-if config["natural_sort"]:
-    natural_sort = st.sidebar.toggle('Natural Sort')
-    st.sidebar.info("Natural sorting is the ordering of strings in alphabetical order,\nexcept that multi-digit numbers are treated atomically, i.e., as if they were a single character. _https://stackoverflow.com/questions/5167928/what-is-natural-ordering-when-we-talk-about-sorting_") 
+sort_order = sort_controls({key: label for key, label in SORT_KEYS.items() if key != "boxes"}, config["sort_by"])
 ########################################################################
 # thumbnail_size = st.sidebar.number_input("Re-Scale Images by percentage", min_value=100, max_value=2000, step = 200)
 # thumbnail_size = st.sidebar.text_input("Re-Scale Images by percentage")
@@ -88,70 +162,89 @@ if not (os.path.exists(imgs_dir_path) and os.path.isdir(imgs_dir_path)):
     st.error(f"Images directory path is wrong or isn't directory: {imgs_dir_path}")
 
 else:
-    if rescursive_search: 
-        all_imgs = [os.path.join(root, file) for root, _, files in os.walk(st.session_state.folder_path) for file in files if is_image_file(file)]
-
+    # The listing is indexed on disk, reruns only re-list directories that changed.
+    # A packed dataset (see pack_dataset.py) lists and reads its images from the shards instead
+    shard_reader = None
+    if is_shard_dir(imgs_dir_path):
+        shard_reader = get_shard_reader(imgs_dir_path, os.path.getmtime(os.path.join(imgs_dir_path, INDEX_FILE)))
+        scanner = shard_reader
+    else:
+        scanner = get_scanner(st.session_state.folder_path, rescursive_search)
+    if st.sidebar.button("🔄 Rescan Directory"):
+        # A file rewritten in place keeps its directory's mtime, the manual rescan re-lists everything
+        scanner.refresh(full=True)
     else:
-        all_imgs = []
-        for img_file_pth in os.listdir(st.session_state.folder_path):
-            if img_file_pth.lower().endswith(('.png', '.jpg', '.jpeg')):
-                all_imgs.append(os.path.join(st.session_state.folder_path, img_file_pth))
+        scanner.refresh_if_stale(config["rescan_interval_s"])
+    num_imgs = scanner.count()
 
-    if len(all_imgs) == 0:
+    if num_imgs == 0:
         st.error(f"No images found in: {imgs_dir_path}, make sure 'Recursive Search' is ON if you are expecting images within directory(s) of the input path.")
     
     else:
-        st.sidebar.write("Total images:", len(all_imgs))
-        num_columns = st.sidebar.number_input("No. of images per row", min_value=1, max_value=10, value = config["num_columns"])
+        st.sidebar.write("Total images:", num_imgs)
 
         ###################################################################################################################################
         imgs_per_page = st.sidebar.number_input("No. of images per page", min_value=100, max_value=1000, value = config["imgs_per_page"], step = 100)
         ###################################################################################################################################
-        all_imgs.sort()
-        
-        # Initialize the current page in session state if it doesn't exist
-        if 'current_page' not in st.session_state:
-            st.session_state.current_page = 0
-            
-        # Calculate total pages
-        total_pages = ceil(len(all_imgs)/imgs_per_page)
-        
-        # Get current page from paginator and update session state
-        location = st.sidebar.empty()
-        page_format_func = lambda i: f"Page {i+1}"
-        st.session_state.current_page = location.selectbox(
-            f"Select a page from < **{total_pages}** > pages", 
-            range(total_pages), 
-            index=st.session_state.current_page,
-            format_func=page_format_func,
-            key="page_selector"
+
+        # Other orders than the listing's own and near-duplicate clusters work on the listing's rows:
+        # the listing and its sort keys are loaded once per rescan, reruns only permute rows
+        shown_rows, similar_counts = None, None
+        sort_keys = get_sort_keys(st.session_state.folder_path, rescursive_search)
+        if sort_order != [("name", False)] or dedup_mode != DEDUP_ALL:
+            sort_keys.update(scanner)
+            if shard_reader is not None and any(key == "dimensions" for key, _ in sort_order):
+                st.sidebar.warning("Images in packed datasets are not sorted by dimensions.")
+                sort_order = [(key, descending) for key, descending in sort_order if key != "dimensions"] or [("name", False)]
+            with st.spinner("Sorting images..."):
+                shown_rows = sort_keys.order(sort_order, executor)
+
+        if dedup_mode != DEDUP_ALL and shard_reader is not None:
+            st.sidebar.warning("Near-duplicate grouping is not available for packed datasets.")
+        elif dedup_mode != DEDUP_ALL:
+            hash_index = get_hash_index(st.session_state.folder_path, rescursive_search)
+            paths, mtimes = sort_keys.paths, sort_keys.mtimes
+            # One hashing chunk per worker at most, so the page's thumbnails are queued right behind them
+            num_workers = config["num_workers"] if config["num_workers"] > 0 else (os.cpu_count() or 1)
+            hash_index.update_in_background(paths, mtimes, executor, config["dedup_max_distance"], max_in_flight=num_workers)
+            if not hash_index.is_current(paths, mtimes):
+                hashed, total = hash_index.progress
+                st.sidebar.info(f"Hashing images for near-duplicate grouping: {hashed}/{total}. Showing all images until it finishes, rerun to refresh.")
+            else:
+                with profiler.stage("near-duplicate grouping"):
+                    clusters = hash_index.clusters(config["dedup_max_distance"])
+                    sizes = np.bincount(clusters, minlength=len(paths))
+                    if dedup_mode == DEDUP_ONE:
+                        # The first image of each cluster stands in for the rest
+                        rows = sort_keys.sort_rows(np.flatnonzero(clusters == np.arange(len(paths))), sort_order)
+                        similar_counts = {paths[row]: int(sizes[row]) - 1 for row in rows}
+                    else:
+                        # Clusters follow the sort order of their first shown image
+                        rows = sort_keys.sort_rows(np.flatnonzero(sizes[clusters] > 1), sort_order)
+                        _, first_seen, cluster_of_row = np.unique(clusters[rows], return_index=True, return_inverse=True)
+                        rows = rows[np.argsort(first_seen[cluster_of_row], kind="stable")]
+                    shown_rows = rows
+                st.sidebar.write("Near-duplicate clusters:", int((sizes > 1).sum()), "· shown images:", len(shown_rows))
+
+        # Get images for a page, from the directory index or the sorted/near-duplicate rows
+        num_shown = num_imgs if shown_rows is None else len(shown_rows)
+        page_images = lambda page: (
+            scanner.page(page * imgs_per_page, imgs_per_page) if shown_rows is None
+            else [sort_keys.paths[row] for row in shown_rows[page * imgs_per_page:(page + 1) * imgs_per_page]]
+        )
+
+        # Paging and column changes only rerun the grid fragment, not the scan and sidebar
+        paginated_grid(
+            num_shown, imgs_per_page, page_images,
+            lambda images, num_columns, page, neighbours: display_images_in_grid(images, num_columns, resize_dim, thumbnail_size, page, neighbours, similar_counts),
+            config["num_columns"], config["prefetch_pages"],
         )
-        
-        # Get images for current page
-        min_index = st.session_state.current_page * imgs_per_page
-        max_index = min_index + imgs_per_page
-        image_iterator = list(itertools.islice(enumerate(all_imgs), min_index, max_index))
-        
-        indices_on_page, images_on_page = map(list, zip(*image_iterator)) if image_iterator else ([], [])
-        
-        # Display images
-        display_images_in_grid(images_on_page, num_columns, resize_dim, thumbnail_size)
-        
-        # Add pagination buttons at the bottom
-        st.sidebar.write("Current Page:", st.session_state.current_page + 1)
-        
-        # Next/Previous buttons at the bottom of page
-        left_col, middle_col, right_col = st.columns([1, 10, 1])
-        
-        # Previous button on left
-        if left_col.button("⬅️ Previous Page", disabled=(st.session_state.current_page <= 0)):
-            st.session_state.current_page = max(0, st.session_state.current_page - 1)
-            st.rerun()
-            
-        # Next button on right
-        if right_col.button("➡️ Next Page", disabled=(st.session_state.current_page >= total_pages - 1)):
-            st.session_state.current_page = min(total_pages - 1, st.session_state.current_page + 1)
-            st.rerun()
+
+st.sidebar.divider()
+st.sidebar.toggle("Profile Stages", key="profile_stages", help="Time each stage of a run: scan, decode, resize, drawing, encoding, transfer.")
+stage_profiler.end_run()
+if stage_profiler.enabled:
+    show_profiling_panel(stage_profiler)
 
 if __name__ == "__main__":
     pass
\ No newline at end of file
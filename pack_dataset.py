@@ -0,0 +1,50 @@
+# Packs an image directory and its YOLO labels into shards for network storage.
+#   python pack_dataset.py --images data/images --out data/images.pack
+# Point image_displayer or display_annotations at the output directory instead of the image
+# directory: a page then loads with a few large reads instead of one open() per file.
+import os
+import os.path as osp
+import sys
+import time
+import argparse
+
+from utils.image_displayer_utils import IMAGE_EXTENSIONS
+from utils.shards import write_shards
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack images and YOLO labels into shards plus an offset index")
+    parser.add_argument("--images", required=True, help="Images directory")
+    parser.add_argument("--labels", help="YOLO labels directory, defaults to <images>/../labels like display_annotations")
+    parser.add_argument("--out", required=True, help="Output directory for the shards and index")
+    parser.add_argument("--recursive", action="store_true", help="Include images in subdirectories")
+    parser.add_argument("--shard-mb", type=int, default=1024, help="Start a new shard file after this many MB")
+    args = parser.parse_args()
+
+    labels_dir = args.labels or osp.join(args.images, "..", "labels")
+    image_paths = []
+    for dir_path, dir_names, file_names in os.walk(args.images):
+        image_paths.extend(osp.join(dir_path, name) for name in file_names if name.lower().endswith(IMAGE_EXTENSIONS))
+        if not args.recursive:
+            break
+    if not image_paths:
+        print(f"No images found in: {args.images}", file=sys.stderr)
+        return 1
+    if not osp.isdir(labels_dir):
+        print(f"No labels directory at {labels_dir}, packing images only")
+        labels_dir = None
+
+    start = time.perf_counter()
+    def progress(done, total):
+        if done % 500 == 0 or done == total:
+            elapsed = time.perf_counter() - start
+            sys.stderr.write(f"\r{done}/{total} images · {done / max(elapsed, 1e-9):.0f} img/s   ")
+    index = write_shards(image_paths, args.images, labels_dir, args.out, args.shard_mb * 1024 * 1024, progress)
+    sys.stderr.write("\n")
+
+    total_bytes = int(index["size"].sum() + index["label_size"].clip(0).sum())
+    print(f"Packed {len(index)} images ({(index['label_size'] >= 0).sum()} with labels), "
+          f"{total_bytes / 1e6:.1f} MB in {int(index['shard'].max()) + 1} shards, {time.perf_counter() - start:.1f}s")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
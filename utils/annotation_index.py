@@ -0,0 +1,156 @@
+import os
+import os.path as osp
+import time
+import hashlib
+import threading
+import numpy as np
+
+from utils.annotation_utils import load_yolo_labels
+from utils.profiling import profiler
+
+# Box size is measured as sqrt(w * h) in normalized units, i.e. relative to the image side
+SIZE_BIN_EDGES = np.array([0.0, 0.01, 0.02, 0.05, 0.1, 0.25, 0.5, np.inf])
+TINY_BOX_BINS = 2  # boxes below 2% of the image side count as tiny
+
+def summarize_labels(label_path):
+    # (classes, per-class box counts, size histogram) for one label file
+    labels = load_yolo_labels(label_path)
+    classes, class_counts = np.unique(labels[:, 0].astype(np.int64), return_counts=True)
+    sizes = np.sqrt(np.clip(labels[:, 3] * labels[:, 4], 0, None))
+    size_hist = np.histogram(sizes, bins=SIZE_BIN_EDGES)[0]
+    return classes, class_counts, size_hist
+
+
+class AnnotationIndex:
+    # Columnar summary of every YOLO label file in a directory, stored as one .npz per
+    # labels directory. Per image it keeps the mtime, box count, box size histogram and
+    # the classes present (CSR: image_offsets into class_ids/class_counts), which is
+    # enough to filter and paginate by class, box count or tiny boxes without opening
+    # any label file at render time. A refresh only re-parses files whose mtime changed.
+
+    def __init__(self, labels_dir, index_dir):
+        self.labels_dir = labels_dir
+        index_dir = osp.abspath(osp.expanduser(index_dir))
+        os.makedirs(index_dir, exist_ok=True)
+        digest = hashlib.sha1(osp.abspath(labels_dir).encode("utf-8")).hexdigest()
+        self.index_path = osp.join(index_dir, f"labels_{digest}.npz")
+        self.last_refresh = None
+        self._lock = threading.Lock()
+
+        self.stems = np.array([], dtype=str)
+        self.mtimes = np.zeros(0, dtype=np.int64)
+        self.box_counts = np.zeros(0, dtype=np.int64)
+        self.size_hist = np.zeros((0, len(SIZE_BIN_EDGES) - 1), dtype=np.int64)
+        self.image_offsets = np.zeros(1, dtype=np.int64)
+        self.class_ids = np.zeros(0, dtype=np.int64)
+        self.class_counts = np.zeros(0, dtype=np.int64)
+        if osp.exists(self.index_path):
+            with np.load(self.index_path) as data:
+                for name in ("stems", "mtimes", "box_counts", "size_hist", "image_offsets", "class_ids", "class_counts"):
+                    setattr(self, name, data[name])
+
+    def refresh(self, executor=None):
+        # Returns the number of label files that had to be parsed
+        with self._lock, profiler.stage("label index refresh"):
+            found = []
+            with os.scandir(self.labels_dir) as it:
+                for entry in it:
+                    if entry.name.endswith(".txt") and entry.is_file():
+                        found.append((osp.splitext(entry.name)[0], entry.stat().st_mtime_ns))
+            found.sort()
+            stems = np.array([stem for stem, _ in found], dtype=str)
+            mtimes = np.array([mtime for _, mtime in found], dtype=np.int64)
+
+            # Rows whose stem and mtime match the previous index are carried over as is
+            old_rows = np.searchsorted(self.stems, stems) if len(self.stems) else np.zeros(len(stems), dtype=np.int64)
+            old_rows = np.minimum(old_rows, max(len(self.stems) - 1, 0))
+            reuse = np.zeros(len(stems), dtype=bool)
+            if len(self.stems):
+                reuse = (self.stems[old_rows] == stems) & (self.mtimes[old_rows] == mtimes)
+
+            changed = np.flatnonzero(~reuse)
+            label_paths = [osp.join(self.labels_dir, stems[row] + ".txt") for row in changed]
+            summaries = list(executor.map(summarize_labels, label_paths)) if executor else [summarize_labels(path) for path in label_paths]
+            parsed = dict(zip(changed.tolist(), summaries))
+
+            per_image_classes, per_image_counts = [], []
+            box_counts = np.zeros(len(stems), dtype=np.int64)
+            size_hist = np.zeros((len(stems), len(SIZE_BIN_EDGES) - 1), dtype=np.int64)
+            for row in range(len(stems)):
+                if reuse[row]:
+                    old = old_rows[row]
+                    start, stop = self.image_offsets[old], self.image_offsets[old + 1]
+                    per_image_classes.append(self.class_ids[start:stop])
+                    per_image_counts.append(self.class_counts[start:stop])
+                    box_counts[row] = self.box_counts[old]
+                    size_hist[row] = self.size_hist[old]
+                else:
+                    classes, class_counts, hist = parsed[row]
+                    per_image_classes.append(classes)
+                    per_image_counts.append(class_counts)
+                    box_counts[row] = class_counts.sum()
+                    size_hist[row] = hist
+
+            self.stems, self.mtimes, self.box_counts, self.size_hist = stems, mtimes, box_counts, size_hist
+            self.image_offsets = np.concatenate([[0], np.cumsum([len(c) for c in per_image_classes], dtype=np.int64)])
+            self.class_ids = np.concatenate(per_image_classes).astype(np.int64) if per_image_classes else np.zeros(0, dtype=np.int64)
+            self.class_counts = np.concatenate(per_image_counts).astype(np.int64) if per_image_counts else np.zeros(0, dtype=np.int64)
+
+            tmp_path = self.index_path + ".tmp.npz"
+            np.savez(
+                tmp_path, stems=self.stems, mtimes=self.mtimes, box_counts=self.box_counts, size_hist=self.size_hist,
+                image_offsets=self.image_offsets, class_ids=self.class_ids, class_counts=self.class_counts,
+            )
+            os.replace(tmp_path, self.index_path)
+            self.last_refresh = time.time()
+            return len(changed)
+
+    def refresh_if_stale(self, max_age_s, executor=None):
+        if self.last_refresh is None or time.time() - self.last_refresh > max_age_s:
+            return self.refresh(executor)
+        return 0
+
+    def class_stats(self):
+        # {class_id: (number of images, number of boxes)}
+        classes, inverse = np.unique(self.class_ids, return_inverse=True)
+        images = np.bincount(inverse, minlength=len(classes))
+        boxes = np.bincount(inverse, weights=self.class_counts, minlength=len(classes)).astype(np.int64)
+        return {int(c): (int(i), int(b)) for c, i, b in zip(classes, images, boxes)}
+
+    def filter_mask(self, classes=None, min_boxes=0, max_boxes=None, tiny_only=False):
+        # Boolean mask over self.stems
+        mask = self.box_counts >= min_boxes
+        if max_boxes is not None:
+            mask &= self.box_counts <= max_boxes
+        if tiny_only:
+            mask &= self.size_hist[:, :TINY_BOX_BINS].sum(axis=1) > 0
+        if classes:
+            has_class = np.isin(self.class_ids, list(classes)).astype(np.int64)
+            # Sum the per-image segments of the CSR arrays, empty segments sum to 0
+            per_image = np.add.reduceat(np.append(has_class, 0), self.image_offsets[:-1]) if len(self.stems) else np.zeros(0, dtype=np.int64)
+            per_image[self.image_offsets[:-1] == self.image_offsets[1:]] = 0
+            mask &= per_image > 0
+        return mask
+
+    def box_counts_for(self, image_paths):
+        # Box count per image path, images without a label file count as 0
+        image_stems = np.array([osp.splitext(osp.basename(path))[0] for path in image_paths], dtype=str)
+        if not len(self.stems) or not len(image_stems):
+            return np.zeros(len(image_stems), dtype=np.int64)
+        rows = np.minimum(np.searchsorted(self.stems, image_stems), len(self.stems) - 1)
+        return np.where(self.stems[rows] == image_stems, self.box_counts[rows], 0)
+
+    def filter_images(self, image_paths, classes=None, min_boxes=0, max_boxes=None, tiny_only=False):
+        # Keep the image paths whose label file matches, images without labels count as 0 boxes
+        image_paths = list(image_paths)
+        if not image_paths:
+            return []
+        image_stems = np.array([osp.splitext(osp.basename(path))[0] for path in image_paths], dtype=str)
+        rows = np.minimum(np.searchsorted(self.stems, image_stems), max(len(self.stems) - 1, 0))
+        labelled = (self.stems[rows] == image_stems) if len(self.stems) else np.zeros(len(image_stems), dtype=bool)
+
+        row_mask = self.filter_mask(classes, min_boxes, max_boxes, tiny_only)
+        keep = labelled & row_mask[rows] if len(self.stems) else labelled
+        if not classes and not tiny_only and min_boxes <= 0 and (max_boxes is None or max_boxes >= 0):
+            keep |= ~labelled
+        return [path for path, kept in zip(image_paths, keep.tolist()) if kept]
@@ -0,0 +1,185 @@
+from PIL import ImageFile, Image, ImageDraw, ImageFont
+ImageFile.LOAD_TRUNCATED_IMAGES = True
+from functools import lru_cache
+import io
+import os.path as osp
+import colorsys
+import warnings
+import numpy as np
+import yaml
+from utils.image_displayer_utils import open_image_for_display, fit_for_display, encode_image
+from utils.profiling import profiler
+
+PALETTE_SIZE = 1024
+
+@lru_cache(maxsize=None)
+def get_palette(num_colors=PALETTE_SIZE):
+    # Deterministic (num_colors, 3) uint8 palette of bold colors, each pick being the candidate
+    # farthest (RGB distance) from everything picked so far, so the first classes get the most
+    # distinct colors. Built once per process with vectorized distance updates.
+    hues = np.linspace(0, 1, 360, endpoint=False)
+    candidates = np.array([
+        colorsys.hsv_to_rgb(h, s, v) for s in (0.9, 0.75) for v in (1.0, 0.75, 0.5) for h in hues
+    ]) * 255
+    picked = [0]
+    min_dist = np.linalg.norm(candidates - candidates[0], axis=1)
+    for _ in range(min(num_colors, len(candidates)) - 1):
+        next_color = int(np.argmax(min_dist))
+        picked.append(next_color)
+        min_dist = np.minimum(min_dist, np.linalg.norm(candidates - candidates[next_color], axis=1))
+    palette = candidates[picked].astype(np.uint8)
+    # Past the candidate pool the palette simply repeats
+    return np.resize(palette, (num_colors, 3))
+
+def get_color_for_class(class_id):
+    palette = get_palette()
+    return tuple(int(c) for c in palette[int(class_id) % len(palette)])
+
+@lru_cache(maxsize=64)
+def get_font(font_size):
+    try:
+        return ImageFont.truetype("arial.ttf", font_size)
+    except OSError:
+        return ImageFont.load_default()
+
+def _open_labels(label_path):
+    # Label files come as a path, or as their bytes when read from a packed dataset
+    if isinstance(label_path, (bytes, bytearray, memoryview)):
+        return io.StringIO(bytes(label_path).decode("utf-8"))
+    return open(label_path, 'r')
+
+def has_labels(label_path):
+    return label_path is not None and (not isinstance(label_path, str) or osp.exists(label_path))
+
+def load_yolo_labels(label_path):
+    # Whole label file as an (N, 5) array of class, x_center, y_center, width, height.
+    # Labels already in that layout (from a COCO box table) are passed through
+    if isinstance(label_path, np.ndarray):
+        return label_path.reshape(-1, 5)
+    if (len(label_path) if isinstance(label_path, (bytes, bytearray, memoryview)) else osp.getsize(label_path)) == 0:
+        return np.zeros((0, 5))
+    try:
+        with warnings.catch_warnings(), _open_labels(label_path) as f:
+            warnings.simplefilter("ignore")
+            labels = np.loadtxt(f, dtype=np.float64, ndmin=2)
+        if labels.shape[1] == 5:
+            return labels
+    except ValueError:
+        pass
+    # Ragged file, keep only the well-formed lines like the line by line parser did
+    with _open_labels(label_path) as f:
+        rows = [parts for parts in (line.split() for line in f) if len(parts) == 5]
+    return np.array(rows, dtype=np.float64).reshape(-1, 5)
+
+def yolo_to_pixel_boxes(labels, img_width, img_height):
+    # Normalized center/size boxes to integer (x1, y1, x2, y2) pixel corners
+    x_center, y_center, width, height = labels[:, 1], labels[:, 2], labels[:, 3], labels[:, 4]
+    corners = np.stack([
+        (x_center - width / 2) * img_width,
+        (y_center - height / 2) * img_height,
+        (x_center + width / 2) * img_width,
+        (y_center + height / 2) * img_height,
+    ], axis=1)
+    return corners.astype(np.int64)
+
+@lru_cache(maxsize=4096)
+def _make_label_patch(label, color, font_size):
+    # Label tag as a small image: white text on the class color, 3px/2px padding.
+    # Patches are only ever pasted, so one copy is shared by every image and thread
+    font = get_font(font_size)
+    text_bbox = font.getbbox(label)
+    width = max(text_bbox[2] - text_bbox[0] + 7, text_bbox[2] + 3)
+    height = max(text_bbox[3] - text_bbox[1] + 5, text_bbox[3] + 2)
+    patch = Image.new("RGB", (width, height), color)
+    ImageDraw.Draw(patch).text((3, 2), label, fill="white", font=font)
+    return patch
+
+def load_label_names(yaml_path):
+    # Class names from a YOLO dataset.yaml, raises ValueError if "names" is not a list
+    with open(yaml_path, 'r') as yf:
+        yaml_dict = yaml.safe_load(yf)
+    label_names = yaml_dict.get('names', None)
+    if not isinstance(label_names, (list, tuple)):
+        raise ValueError('Invalid "names" format in YAML; expected a list.')
+    return list(label_names)
+
+def label_path_for(image_path, labels_dir):
+    return osp.join(labels_dir, osp.splitext(osp.basename(image_path))[0] + ".txt")
+
+def render_grid_image(image_path, labels_dir, label_names=None, resize_dim=None, thumbnail_size=None, max_edge=None, draw_at_display_size=False, fmt=None, quality=85):
+    # Module level with plain arguments so it can be shipped to a process pool.
+    # With `fmt` the rendered image comes back encoded, ready to send to the browser
+    img = render_annotations(
+        image_path, label_path_for(image_path, labels_dir), label_names,
+        resize_dim, thumbnail_size, max_edge, draw_at_display_size,
+    )
+    return encode_image(img, fmt, quality) if fmt else img
+
+def render_labelled_grid_image(image_file, label_data, label_names=None, resize_dim=None, thumbnail_size=None, max_edge=None, draw_at_display_size=False, fmt=None, quality=85):
+    # render_grid_image with the labels passed in rather than looked up in a labels directory:
+    # label file bytes from a packed dataset or an (N, 5) array from a COCO box table,
+    # None when the image has no labels. image_file is a path or an in-memory file
+    img = render_annotations(image_file, label_data, label_names, resize_dim, thumbnail_size, max_edge, draw_at_display_size)
+    return encode_image(img, fmt, quality) if fmt else img
+
+def render_annotations(image_path, label_path, label_names=None, resize_dim=None, thumbnail_size=None, max_edge=None, draw_at_display_size=False):
+    # Boxes are drawn in normalized coordinates, so a reduced-scale decode lines up the same way
+    with profiler.stage("decode"):
+        img = open_image_for_display(image_path, resize_dim, thumbnail_size, max_edge).convert("RGB")
+    if draw_at_display_size:
+        # Shrink first and draw on the small buffer, line width and font follow the display size
+        with profiler.stage("resize"):
+            img = fit_for_display(img, resize_dim, thumbnail_size, max_edge)
+        return draw_annotations(img, label_path, label_names)
+    img = draw_annotations(img, label_path, label_names)
+    with profiler.stage("resize"):
+        return fit_for_display(img, resize_dim, thumbnail_size, max_edge)
+
+def draw_annotations(img, label_path, label_names=None):
+    draw = ImageDraw.Draw(img)
+    img_width, img_height = img.size
+
+    thickness = max(1, img_height // 300)
+    font_size = max(10, img_height // 40)
+
+    if has_labels(label_path):
+        with profiler.stage("parse labels"):
+            labels = load_yolo_labels(label_path)
+        class_ids = labels[:, 0].astype(np.int64)
+        boxes = yolo_to_pixel_boxes(labels, img_width, img_height)
+
+        with profiler.stage("draw boxes"):
+            # Colors and label tags are resolved once per class, not once per box
+            label_patches = {}
+            for cls_id in np.unique(class_ids).tolist():
+                if label_names and 0 <= cls_id < len(label_names):
+                    label = label_names[cls_id]
+                else:
+                    label = str(cls_id)
+                label_patches[cls_id] = _make_label_patch(label, tuple(int(c) for c in get_color_for_class(cls_id)), font_size)
+
+            # Outlines first, then the pre-rendered label tags pasted on top
+            for (x1, y1, x2, y2), cls_id in zip(boxes.tolist(), class_ids.tolist()):
+                draw.rectangle([x1, y1, x2, y2], outline=label_patches[cls_id].getpixel((0, 0)), width=thickness)
+            for (x1, y1, _, _), cls_id in zip(boxes.tolist(), class_ids.tolist()):
+                img.paste(label_patches[cls_id], (x1, y1))
+    else:
+        text = "NO LABELS FOUND"
+        font_size = max(20, img_height // 15)  # Font size is proportional to image height (you can adjust the divisor for your liking)
+        font = get_font(font_size)
+
+        text_bbox = font.getbbox(text)
+        text_width = text_bbox[2] - text_bbox[0]
+        text_height = text_bbox[3] - text_bbox[1]
+
+        box_x = (img_width - text_width) // 2
+        box_y = 10
+        box_padding = 10  # Increased padding for better readability
+        box_coords = [
+            (box_x - box_padding, box_y - box_padding),
+            (box_x + text_width + box_padding, box_y + text_height + box_padding)
+        ]
+
+        draw.rectangle(box_coords, fill=(139, 0, 0))  # Dark red background
+        draw.text((box_x, box_y), text, fill="white", font=font)
+    return img
@@ -0,0 +1,84 @@
+import os
+import os.path as osp
+import json
+import tempfile
+from PIL import Image
+
+from utils.annotation_utils import render_annotations, label_path_for
+from utils.image_displayer_utils import encode_image
+from utils.mosaic import make_tile, compose_mosaic
+
+FORMAT_EXTENSIONS = {"JPEG": ".jpg", "WEBP": ".webp", "PNG": ".png"}
+
+def write_atomic(path, data):
+    # A killed export never leaves a truncated file behind that a resumed run would skip
+    os.makedirs(osp.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=osp.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def is_up_to_date(output_path, source_paths):
+    # Output exists and is newer than every source that exists
+    try:
+        output_mtime = os.stat(output_path).st_mtime_ns
+    except OSError:
+        return False
+    return all(os.stat(path).st_mtime_ns <= output_mtime for path in source_paths if osp.exists(path))
+
+def export_annotated_chunk(jobs, labels_dir, label_names=None, max_edge=None, draw_at_display_size=False, fmt="JPEG", quality=90):
+    # Worker task: renders and writes one chunk of (image_path, output_path) jobs.
+    # Only counts go back to the parent, so memory stays bounded by the chunks in flight
+    written, failed = 0, []
+    for image_path, output_path in jobs:
+        try:
+            img = render_annotations(
+                image_path, label_path_for(image_path, labels_dir), label_names,
+                max_edge=max_edge, draw_at_display_size=draw_at_display_size,
+            )
+            write_atomic(output_path, encode_image(img, fmt, quality))
+            written += 1
+        except Exception as e:
+            failed.append((image_path, str(e)))
+    return written, failed
+
+def export_contact_sheet(image_paths, sheet_path, labels_dir, label_names=None, num_columns=8, tile_size=256, fmt="JPEG", quality=90):
+    # Worker task: one contact sheet, plus a JSON index from grid position to image
+    # written next to it. The index is written last, a resumed run checks it to skip the sheet;
+    # a sheet with failed images lists them there and is retried
+    tiles, index = [], []
+    failed = []
+    for image_path in image_paths:
+        try:
+            img = render_annotations(
+                image_path, label_path_for(image_path, labels_dir), label_names,
+                max_edge=tile_size, draw_at_display_size=True,
+            )
+            tiles.append(make_tile(img, tile_size))
+            index.append(image_path)
+        except Exception as e:
+            failed.append((image_path, str(e)))
+    if tiles:
+        canvas, boxes = compose_mosaic(tiles, num_columns, tile_size)
+        write_atomic(sheet_path, encode_image(Image.fromarray(canvas), fmt, quality))
+        entries = [
+            {"row": row + 1, "column": col + 1, "x": x, "y": y, "width": width, "height": height, "path": path}
+            for path, (row, col, x, y, width, height) in zip(index, boxes)
+        ]
+        write_atomic(sheet_index_path(sheet_path), json.dumps({"images": list(image_paths), "tiles": entries, "failed": [path for path, _ in failed]}, indent=1).encode("utf-8"))
+    return len(tiles), failed
+
+def sheet_index_path(sheet_path):
+    return osp.splitext(sheet_path)[0] + ".json"
+
+def is_sheet_done(image_paths, sheet_path, labels_dir):
+    # Same images in the same order as the finished sheet, none of them failed, and no image or
+    # label changed since. Indexes from before the failed list count as incomplete
+    try:
+        with open(sheet_index_path(sheet_path)) as f:
+            done = json.load(f)
+        done_images, done_failed = done["images"], done["failed"]
+    except (OSError, ValueError, KeyError):
+        return False
+    sources = list(image_paths) + [label_path_for(path, labels_dir) for path in image_paths]
+    return done_images == list(image_paths) and not done_failed and is_up_to_date(sheet_path, sources)
@@ -0,0 +1,213 @@
+import os
+import os.path as osp
+import json
+import hashlib
+import threading
+import numpy as np
+
+from utils.profiling import profiler
+
+# Per-image box table built once from a COCO annotations.json: boxes.npy holds every box as
+# (class, x_center, y_center, width, height) normalized like YOLO labels, grouped by image,
+# offsets.npy the start of each image's boxes (names.json order) plus the total at the end.
+# Classes are indexes into categories.json, COCO category ids are usually sparse
+BOX_DTYPE = np.dtype([("cls", "<i4"), ("x", "<f4"), ("y", "<f4"), ("w", "<f4"), ("h", "<f4")])
+
+def iter_json_array_items(f, keys, chunk_size=1 << 20):
+    # Yields (key, value) for the top-level members of the JSON object in text file `f` whose
+    # key is in `keys`, one array item at a time for arrays. Reads `f` in chunks and decodes
+    # each item with raw_decode, so memory is bounded by the largest item, not the file
+    decoder = json.JSONDecoder()
+    buf, pos, eof = "", 0, False
+
+    def fill():
+        nonlocal buf, pos, eof
+        chunk = f.read(chunk_size)
+        if not chunk:
+            eof = True
+            return False
+        buf, pos = buf[pos:] + chunk, 0
+        return True
+
+    def skip_ws():
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n":
+                pos += 1
+            if pos < len(buf) or not fill():
+                return
+
+    def expect(chars):
+        nonlocal pos
+        skip_ws()
+        if pos >= len(buf) or buf[pos] not in chars:
+            raise ValueError(f"Expected one of {chars!r} in JSON at offset {pos}")
+        pos += 1
+        return buf[pos - 1]
+
+    def decode():
+        nonlocal pos
+        skip_ws()
+        while True:
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if not fill():
+                    raise
+                continue
+            # A number that ends the buffer may continue in the next chunk
+            if end == len(buf) and not eof and fill():
+                continue
+            pos = end
+            return value
+
+    expect("{")
+    skip_ws()
+    if buf[pos:pos + 1] == "}":
+        return
+    while True:
+        key = decode()
+        expect(":")
+        skip_ws()
+        if buf[pos:pos + 1] == "[":
+            pos += 1
+            skip_ws()
+            if buf[pos:pos + 1] == "]":
+                pos += 1
+            else:
+                while True:
+                    item = decode()
+                    if key in keys:
+                        yield key, item
+                    if expect(",]") == "]":
+                        break
+        else:
+            value = decode()
+            if key in keys:
+                yield key, value
+        if expect(",}") == "}":
+            return
+
+
+class CocoIndex:
+    # On-disk box table for one COCO annotations file, under index_dir and keyed on the file's
+    # path, size and mtime. build() streams the JSON once; afterwards labels_for() reads one
+    # image's boxes from the memory-mapped table, so a page touches only its own rows.
+    # Images are matched to the grid by file name, like YOLO labels are matched by stem.
+
+    def __init__(self, json_path, index_dir):
+        self.json_path = json_path
+        st = os.stat(json_path)
+        raw = f"{osp.abspath(json_path)}|{st.st_mtime_ns}|{st.st_size}"
+        self.index_dir = osp.join(osp.abspath(osp.expanduser(index_dir)), "coco_" + hashlib.sha1(raw.encode("utf-8")).hexdigest())
+        self.meta_path = osp.join(self.index_dir, "meta.json")
+        self.category_names = None
+        self._lock = threading.Lock()
+        if self.is_built():
+            self._load()
+
+    def is_built(self):
+        return osp.exists(self.meta_path)
+
+    def _load(self):
+        with open(osp.join(self.index_dir, "names.json")) as f:
+            self.rows = {name: row for row, name in enumerate(json.load(f))}
+        with open(osp.join(self.index_dir, "categories.json")) as f:
+            self.category_names = [category["name"] for category in json.load(f)]
+        self.offsets = np.load(osp.join(self.index_dir, "offsets.npy"), mmap_mode="r")
+        self.boxes = np.load(osp.join(self.index_dir, "boxes.npy"), mmap_mode="r")
+
+    def build(self, progress=None, flush_rows=200_000):
+        # progress(bytes read, total bytes) is called as the JSON is streamed.
+        # Sessions opening the same file at once wait for one build
+        with self._lock:
+            if self.is_built():
+                self._load()
+                return len(self.rows), len(self.boxes)
+            return self._build(progress, flush_rows)
+
+    def _build(self, progress, flush_rows):
+        os.makedirs(self.index_dir, exist_ok=True)
+        raw_path = osp.join(self.index_dir, "boxes.raw.tmp")
+        images, categories = {}, {}
+        pending, num_raw = [], 0
+        total_bytes = os.path.getsize(self.json_path)
+
+        # Pass 1: stream the JSON, boxes go to a flat float64 scratch file as they are decoded
+        with profiler.stage("coco parse"), open(self.json_path, "r", encoding="utf-8") as f, open(raw_path, "wb") as raw:
+            for count, (key, item) in enumerate(iter_json_array_items(f, ("images", "annotations", "categories"))):
+                if key == "annotations":
+                    bbox = item.get("bbox")
+                    if bbox and len(bbox) == 4:
+                        pending.append((item["image_id"], item["category_id"], *bbox))
+                    if len(pending) >= flush_rows:
+                        np.asarray(pending, dtype=np.float64).tofile(raw)
+                        num_raw += len(pending)
+                        pending = []
+                elif key == "images":
+                    images[item["id"]] = (osp.basename(item["file_name"]), item.get("width") or 0, item.get("height") or 0)
+                elif key == "categories":
+                    categories[item["id"]] = item.get("name", str(item["id"]))
+                if progress and count % 100_000 == 0:
+                    progress(f.buffer.tell(), total_bytes)
+            np.asarray(pending, dtype=np.float64).reshape(-1, 6).tofile(raw)
+            num_raw += len(pending)
+
+        # Pass 2: group the boxes by image (names order) and normalize them
+        with profiler.stage("coco index"):
+            names_order = sorted(images, key=lambda image_id: images[image_id][0])
+            image_ids = np.array(names_order, dtype=np.float64)
+            sizes = np.array([images[image_id][1:] for image_id in names_order], dtype=np.float64).reshape(-1, 2)
+            raw_boxes = np.memmap(raw_path, dtype=np.float64, mode="r", shape=(num_raw, 6)) if num_raw else np.zeros((0, 6))
+            # Boxes may use categories that are not listed, they get their id as the name
+            for category_id in np.unique(raw_boxes[:, 1]).astype(np.int64).tolist():
+                categories.setdefault(category_id, str(category_id))
+            category_ids = sorted(categories)
+
+            # Image row of every box; boxes of images missing from "images" are dropped
+            sorter = np.argsort(image_ids)
+            rows = np.searchsorted(image_ids, raw_boxes[:, 0], sorter=sorter).clip(0, max(len(image_ids) - 1, 0))
+            rows = sorter[rows] if len(image_ids) else np.zeros(num_raw, dtype=np.int64)
+            valid = (image_ids[rows] == raw_boxes[:, 0]) if len(image_ids) else np.zeros(num_raw, dtype=bool)
+            order = np.flatnonzero(valid)[np.argsort(rows[valid], kind="stable")]
+            offsets = np.concatenate([[0], np.cumsum(np.bincount(rows[valid], minlength=len(image_ids)))]).astype(np.int64)
+
+            category_lookup = np.array(category_ids, dtype=np.float64)
+            boxes = np.lib.format.open_memmap(osp.join(self.index_dir, "boxes.npy"), mode="w+", dtype=BOX_DTYPE, shape=(len(order),))
+            for start in range(0, len(order), flush_rows):
+                chunk_rows = order[start:start + flush_rows]
+                chunk = raw_boxes[chunk_rows]
+                width, height = sizes[rows[chunk_rows]].T
+                width, height = np.where(width > 0, width, 1), np.where(height > 0, height, 1)
+                boxes["cls"][start:start + len(chunk)] = np.searchsorted(category_lookup, chunk[:, 1])
+                boxes["x"][start:start + len(chunk)] = (chunk[:, 2] + chunk[:, 4] / 2) / width
+                boxes["y"][start:start + len(chunk)] = (chunk[:, 3] + chunk[:, 5] / 2) / height
+                boxes["w"][start:start + len(chunk)] = chunk[:, 4] / width
+                boxes["h"][start:start + len(chunk)] = chunk[:, 5] / height
+            boxes.flush()
+            del boxes, raw_boxes
+
+            np.save(osp.join(self.index_dir, "offsets.npy"), offsets)
+            with open(osp.join(self.index_dir, "names.json"), "w") as f:
+                json.dump([images[image_id][0] for image_id in names_order], f)
+            with open(osp.join(self.index_dir, "categories.json"), "w") as f:
+                json.dump([{"id": category_id, "name": categories[category_id]} for category_id in category_ids], f)
+            os.remove(raw_path)
+            # Written last, an interrupted build is started over
+            with open(self.meta_path, "w") as f:
+                json.dump({"source": osp.abspath(self.json_path), "images": len(names_order), "boxes": int(len(order))}, f)
+        self._load()
+        return len(names_order), int(len(order))
+
+    def box_counts_for(self, image_paths):
+        # Box count per image path, images not in the annotations count as 0
+        counts = np.diff(self.offsets)
+        return np.fromiter((counts[self.rows[name]] if name in self.rows else 0 for name in map(osp.basename, image_paths)), dtype=np.int64, count=len(image_paths))
+
+    def labels_for(self, image_path):
+        # (N, 5) array in YOLO label layout, or None when the image is not in the annotations
+        row = self.rows.get(osp.basename(image_path))
+        if row is None:
+            return None
+        boxes = self.boxes[self.offsets[row]:self.offsets[row + 1]]
+        return np.column_stack([boxes["cls"], boxes["x"], boxes["y"], boxes["w"], boxes["h"]]).astype(np.float64)
@@ -0,0 +1,120 @@
+import os
+import os.path as osp
+import time
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+
+from utils.profiling import profiler
+
+
+class DirectoryScanner:
+    # Persistent listing of the image files under one root directory.
+    # The index lives in SQLite next to the other caches, one database per
+    # (root, extensions, recursive) combination, and stores each file's size and mtime.
+    # A refresh only re-lists directories whose mtime changed since the last scan,
+    # unchanged directories are walked through the subdirectory lists stored in the index.
+
+    def __init__(self, root, index_dir, extensions, recursive=False):
+        self.root = root
+        self.extensions = tuple(ext.lower() for ext in extensions)
+        self.recursive = recursive
+        self.last_refresh = None
+
+        index_dir = osp.abspath(osp.expanduser(index_dir))
+        os.makedirs(index_dir, exist_ok=True)
+        raw = f"{osp.abspath(root)}|{','.join(sorted(self.extensions))}|{recursive}"
+        self.db_path = osp.join(index_dir, hashlib.sha1(raw.encode("utf-8")).hexdigest() + ".sqlite")
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._db.executescript("""
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, mtime_ns INTEGER, subdirs TEXT);
+            CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, dir TEXT, size INTEGER, mtime_ns INTEGER);
+            CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+        """)
+
+    def _list_dir(self, dir_path):
+        files, subdirs = [], []
+        with os.scandir(dir_path) as it:
+            for entry in it:
+                try:
+                    # Like os.walk, symlinked directories are listed but not followed
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.name.lower().endswith(self.extensions) and entry.is_file():
+                        st = entry.stat()
+                        files.append((entry.path, dir_path, st.st_size, st.st_mtime_ns))
+                except OSError:
+                    continue
+        return files, subdirs
+
+    def refresh(self, full=False):
+        # Returns the number of directories that had to be re-listed.
+        # A file rewritten in place does not bump its directory's mtime, use full=True to
+        # pick up new sizes/mtimes for those.
+        with self._lock, profiler.stage("directory scan"):
+            known = {path: (mtime_ns, subdirs) for path, mtime_ns, subdirs in self._db.execute("SELECT path, mtime_ns, subdirs FROM dirs")}
+            seen = set()
+            rescanned = 0
+            stack = [self.root]
+            while stack:
+                dir_path = stack.pop()
+                try:
+                    mtime_ns = os.stat(dir_path).st_mtime_ns
+                except OSError:
+                    continue
+                seen.add(dir_path)
+
+                if not full and dir_path in known and known[dir_path][0] == mtime_ns:
+                    subdirs = known[dir_path][1].split("\n") if known[dir_path][1] else []
+                else:
+                    try:
+                        files, subdirs = self._list_dir(dir_path)
+                    except OSError:
+                        seen.discard(dir_path)
+                        continue
+                    self._db.execute("DELETE FROM files WHERE dir = ?", (dir_path,))
+                    self._db.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)", files)
+                    self._db.execute("INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)", (dir_path, mtime_ns, "\n".join(subdirs)))
+                    rescanned += 1
+
+                if self.recursive:
+                    stack.extend(subdirs)
+
+            removed = [(dir_path,) for dir_path in known if dir_path not in seen]
+            self._db.executemany("DELETE FROM files WHERE dir = ?", removed)
+            self._db.executemany("DELETE FROM dirs WHERE path = ?", removed)
+            self._db.commit()
+            self.last_refresh = time.time()
+            return rescanned
+
+    def refresh_if_stale(self, max_age_s):
+        if self.last_refresh is None or time.time() - self.last_refresh > max_age_s:
+            return self.refresh()
+        return 0
+
+    def count(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def page(self, offset, limit):
+        # SQLite compares paths as UTF-8 bytes, which is the same order as sorted() on str
+        with self._lock:
+            rows = self._db.execute("SELECT path FROM files ORDER BY path LIMIT ? OFFSET ?", (int(limit), int(offset)))
+            return [row[0] for row in rows]
+
+    def all_paths(self):
+        with self._lock:
+            return [row[0] for row in self._db.execute("SELECT path FROM files ORDER BY path")]
+
+    def all_entries(self):
+        # (paths, sizes, mtimes) in listing order, sizes and mtimes as int64 arrays
+        with self._lock:
+            rows = self._db.execute("SELECT path, size, mtime_ns FROM files ORDER BY path").fetchall()
+        paths = [row[0] for row in rows]
+        sizes = np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows))
+        mtimes = np.fromiter((row[2] for row in rows), dtype=np.int64, count=len(rows))
+        return paths, sizes, mtimes
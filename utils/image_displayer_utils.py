@@ -1,8 +1,15 @@
-from PIL import ImageFile
+from PIL import ImageFile, Image
 ImageFile.LOAD_TRUNCATED_IMAGES = True
+import io
+import os
+from math import ceil
 import itertools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 import streamlit as st
 
+from utils.profiling import profiler, session_profiler
+
 def paginator(label, items, items_per_page=200, on_sidebar=True):
 
     # Figure out where to display the paginator
@@ -31,6 +38,149 @@ def resize_by_percentage(image, percentage):
     resized_dimensions = (int(width * percentage), int(height * percentage))
     return image.resize(resized_dimensions)
 
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff')
+
 def is_image_file(filename):
     # Check if the file has a common image extension
-    return any(filename.lower().endswith(ext) for ext in ['.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff'])
\ No newline at end of file
+    return filename.lower().endswith(IMAGE_EXTENSIONS)
+
+def display_target_size(image_size, resize_dim=None, thumbnail_size=None, max_edge=None):
+    # Size the image ends up at in the grid, or None when it is shown at full resolution
+    if resize_dim:
+        return tuple(resize_dim)
+    edges = [edge for edge in (thumbnail_size, max_edge) if edge]
+    if not edges:
+        return None
+    scale = min(min(edges) / image_size[0], min(edges) / image_size[1], 1.0)
+    return (max(1, int(image_size[0] * scale)), max(1, int(image_size[1] * scale)))
+
+def open_image_for_display(image_path, resize_dim=None, thumbnail_size=None, max_edge=None):
+    img = Image.open(image_path)
+    target_size = display_target_size(img.size, resize_dim, thumbnail_size, max_edge)
+    if target_size and img.format == "JPEG":
+        # libjpeg decodes straight to 1/2, 1/4 or 1/8 scale, draft picks the smallest
+        # reduction that still covers target_size so the final resize keeps its quality
+        img.draft(img.mode, target_size)
+    return img
+
+def fit_for_display(img, resize_dim=None, thumbnail_size=None, max_edge=None):
+    if resize_dim:
+        img = img.resize(resize_dim, Image.Resampling.LANCZOS)
+    if thumbnail_size:
+        img.thumbnail((thumbnail_size, thumbnail_size))
+    # Cap the longest edge, grid cells are never shown larger than this
+    if max_edge and max(img.size) > max_edge:
+        img.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+    return img
+
+def prepare_thumbnail(image_path, resize_dim=None, thumbnail_size=None, max_edge=None):
+    with profiler.stage("decode"):
+        img = open_image_for_display(image_path, resize_dim, thumbnail_size, max_edge)
+        img.load()
+    with profiler.stage("resize"):
+        return fit_for_display(img, resize_dim, thumbnail_size, max_edge)
+
+def encode_image(img, fmt="WEBP", quality=85):
+    fmt = fmt.upper()
+    if fmt == "JPEG":
+        img = img.convert("RGB")
+    elif img.mode not in ("RGB", "RGBA"):
+        has_alpha = img.mode in ("LA", "PA") or "transparency" in img.info
+        img = img.convert("RGBA" if has_alpha else "RGB")
+    buffer = io.BytesIO()
+    with profiler.stage("encode"):
+        img.save(buffer, format=fmt, quality=quality)
+    return buffer.getvalue()
+
+def make_thumbnail_bytes(image_path, resize_dim=None, thumbnail_size=None, max_edge=None, fmt="WEBP", quality=85):
+    # Module level so it can be shipped to a process pool
+    return encode_image(prepare_thumbnail(image_path, resize_dim, thumbnail_size, max_edge), fmt, quality)
+
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+    # Tasks run in the submitter's context, so their profiler stages go to the session that queued them
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+def create_executor(num_workers=0, pool_type="thread"):
+    # num_workers <= 0 means one worker per CPU core
+    num_workers = num_workers if num_workers and num_workers > 0 else (os.cpu_count() or 1)
+    if pool_type == "process":
+        return ProcessPoolExecutor(max_workers=num_workers)
+    return ContextThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="sharingan")
+
+def create_grid_cells(num_items, num_columns):
+    # Lay out the whole grid up front and return one placeholder per item, in grid order
+    cells = []
+    for i in range(0, num_items, num_columns):
+        cols = st.columns(num_columns)
+        cells.extend(col.empty() for col in cols[:min(num_columns, num_items - i)])
+    return cells
+
+def fill_grid_cells(cells, futures, show):
+    # Calls show(cell, index, result) as each future finishes, whatever order they finish in
+    index_of = {future: index for index, future in enumerate(futures)}
+    completed = as_completed(index_of)
+    while True:
+        with profiler.stage("grid wait"):
+            future = next(completed, None)
+        if future is None:
+            break
+        with profiler.stage("st.image"):
+            show(cells[index_of[future]], index_of[future], future.result())
+
+def change_page(step, total_pages):
+    st.session_state.current_page = min(max(0, st.session_state.current_page + step), total_pages - 1)
+
+def sort_controls(sort_keys, default="name"):
+    # Sidebar sort selection, {key: label} -> [(key, descending), ...] primary key first
+    options = list(sort_keys)
+    sort_by = st.sidebar.selectbox(
+        "Sort By", options, index=options.index(default) if default in options else 0, format_func=sort_keys.get,
+        help="Natural sorting is the ordering of strings in alphabetical order, except that multi-digit numbers are treated atomically, i.e., as if they were a single character.",
+    )
+    then_by = st.sidebar.selectbox("Then By", [None] + [key for key in options if key != sort_by], format_func=lambda key: "—" if key is None else sort_keys[key])
+    descending = st.sidebar.toggle("Descending")
+    return [(sort_by, descending)] + ([(then_by, False)] if then_by else [])
+
+@st.fragment
+def paginated_grid(num_items, items_per_page, page_items, display_page, num_columns=3, prefetch_pages=1):
+    # Page selector, grid and Previous/Next buttons as one fragment, so paging and column
+    # changes rerun only this part and not the directory scan and sidebar.
+    # page_items(page) returns that page's items,
+    # display_page(items, num_columns, page, neighbours) draws the grid.
+    total_pages = max(1, ceil(num_items / items_per_page))
+    # Paging reruns only this fragment, time it as a run of its own
+    session_profiler()
+    fragment_run = profiler.begin_run("fragment")
+
+    # Initialize the current page in session state if it doesn't exist, or if the listing shrank under it
+    if st.session_state.get('current_page', 0) >= total_pages:
+        st.session_state.current_page = 0
+    st.session_state.setdefault('current_page', 0)
+
+    page_col, columns_col = st.columns([4, 1])
+    page_format_func = lambda i: f"Page {i+1}"
+    current_page = page_col.selectbox(
+        f"Select a page from < **{total_pages}** > pages",
+        range(total_pages),
+        format_func=page_format_func,
+        key="current_page"
+    )
+    num_columns = columns_col.number_input("No. of images per row", min_value=1, max_value=10, value=num_columns)
+
+    # Pages to prepare in the background while this one is reviewed
+    with profiler.stage("page listing"):
+        neighbours = {
+            page: page_items(page)
+            for page in range(current_page - prefetch_pages, current_page + prefetch_pages + 1)
+            if page != current_page and 0 <= page < total_pages
+        }
+        items = page_items(current_page)
+    display_page(items, num_columns, current_page, neighbours)
+
+    # Next/Previous buttons at the bottom of page
+    left_col, middle_col, right_col = st.columns([1, 10, 1])
+    left_col.button("⬅️ Previous Page", disabled=(current_page <= 0), on_click=change_page, args=(-1, total_pages))
+    right_col.button("➡️ Next Page", disabled=(current_page >= total_pages - 1), on_click=change_page, args=(1, total_pages))
+    if fragment_run:
+        profiler.end_run()
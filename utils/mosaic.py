@@ -0,0 +1,79 @@
+import io
+import os.path as osp
+from math import ceil
+import numpy as np
+from PIL import ImageFile, Image
+ImageFile.LOAD_TRUNCATED_IMAGES = True
+import streamlit as st
+
+from utils.image_displayer_utils import encode_image
+from utils.profiling import profiler
+
+def make_tile(data, tile_size):
+    # Encoded grid cell (or PIL image) to an RGB array that fits in a tile_size square
+    img = Image.open(io.BytesIO(data)) if isinstance(data, (bytes, bytearray)) else data
+    img = img.convert("RGB")
+    img.thumbnail((tile_size, tile_size))
+    return np.asarray(img)
+
+def compose_mosaic(tiles, num_columns, tile_size, gap=4, background=(14, 17, 23)):
+    # Writes the tiles into one preallocated canvas, centered in their cells.
+    # Returns the canvas and (row, column, x, y, width, height) per tile in canvas pixels
+    num_rows = ceil(len(tiles) / num_columns)
+    cell = tile_size + gap
+    canvas = np.empty((num_rows * cell + gap, num_columns * cell + gap, 3), dtype=np.uint8)
+    canvas[:] = background
+    boxes = []
+    for tile_index, tile in enumerate(tiles):
+        row, col = divmod(tile_index, num_columns)
+        height, width = tile.shape[:2]
+        y = gap + row * cell + (tile_size - height) // 2
+        x = gap + col * cell + (tile_size - width) // 2
+        canvas[y:y + height, x:x + width] = tile
+        boxes.append((row, col, x, y, width, height))
+    return canvas, boxes
+
+def build_mosaics(executor, cells, images, num_columns, tile_size, rows_per_mosaic, fmt="JPEG", quality=85):
+    # Whole page as a few encoded mosaic images plus an index from grid position to file.
+    # Tiles are decoded and shrunk on the worker pool, only the array writes happen here
+    tiles = list(executor.map(make_tile, cells, [tile_size] * len(cells)))
+    mosaics, index = [], []
+    tiles_per_mosaic = max(1, rows_per_mosaic) * num_columns
+    for start in range(0, len(tiles), tiles_per_mosaic):
+        canvas, boxes = compose_mosaic(tiles[start:start + tiles_per_mosaic], num_columns, tile_size)
+        mosaics.append(encode_image(Image.fromarray(canvas), fmt, quality))
+        for offset, (row, col, x, y, width, height) in enumerate(boxes):
+            image_path = images[start + offset]
+            index.append({
+                "mosaic": len(mosaics), "row": start // num_columns + row + 1, "column": col + 1,
+                "x": x, "y": y, "width": width, "height": height,
+                "caption": osp.basename(image_path), "path": image_path,
+            })
+    return mosaics, index
+
+def show_mosaic_page(executor, futures, images, num_columns, tile_size, rows_per_mosaic, settings_key=None, fmt="JPEG", quality=85):
+    # Renders the page as a handful of st.image elements instead of one per cell and returns
+    # the bytes sent. The composed page is kept in session state so inspecting tiles does not rebuild it
+    with profiler.stage("grid wait"):
+        cells = [future.result() for future in futures]
+    mosaic_key = (tuple(images), num_columns, tile_size, rows_per_mosaic, settings_key, fmt, quality)
+    cached = st.session_state.get("mosaic_page")
+    if cached is None or cached[0] != mosaic_key:
+        with profiler.stage("mosaic compose"):
+            cached = (mosaic_key, *build_mosaics(executor, cells, images, num_columns, tile_size, rows_per_mosaic, fmt, quality))
+        st.session_state.mosaic_page = cached
+    _, mosaics, index = cached
+
+    for mosaic_number, mosaic in enumerate(mosaics, start=1):
+        with profiler.stage("st.image"):
+            st.image(mosaic, use_container_width=True, caption=f"Mosaic {mosaic_number}/{len(mosaics)}")
+
+    with st.expander("🗺️ Mosaic Index"):
+        selected = st.selectbox(
+            "Inspect tile", range(len(index)),
+            format_func=lambda i: f"Row {index[i]['row']}, column {index[i]['column']} · {index[i]['caption']}",
+        )
+        if selected is not None:
+            st.image(cells[selected], caption=index[selected]["path"])
+        st.dataframe(index, hide_index=True)
+    return sum(len(mosaic) for mosaic in mosaics)
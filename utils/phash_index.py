@@ -0,0 +1,201 @@
+import os
+import os.path as osp
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import wait, FIRST_COMPLETED
+import numpy as np
+from PIL import ImageFile, Image
+ImageFile.LOAD_TRUNCATED_IMAGES = True
+
+HASH_SIZE = 8  # 8x8 difference bits, one uint64 per image
+
+def dhash(image_path):
+    # Difference hash: a 9x8 grayscale thumbnail, one bit per horizontally adjacent pixel pair
+    img = Image.open(image_path)
+    img.draft("L", (HASH_SIZE * 8, HASH_SIZE * 8))
+    pixels = np.asarray(img.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.BOX), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).ravel()
+    return int(np.packbits(bits).view(">u8")[0])
+
+def dhash_many(image_paths):
+    # Module level so chunks can be shipped to a process pool. Returns (hashes, valid): a blank
+    # image hashes to 0 too, so unreadable images are told apart by the mask, not the hash
+    hashes = np.zeros(len(image_paths), dtype=np.uint64)
+    valid = np.zeros(len(image_paths), dtype=bool)
+    for i, image_path in enumerate(image_paths):
+        try:
+            hashes[i] = dhash(image_path)
+            valid[i] = True
+        except Exception:
+            pass
+    return hashes, valid
+
+def popcount64(values):
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    return np.unpackbits(values.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+def _union_find(num_items, a, b):
+    # Connected components of the edges (a, b), as the smallest member index per item
+    parent = np.arange(num_items)
+    while len(a):
+        pa, pb = parent[a], parent[b]
+        differs = pa != pb
+        if not differs.any():
+            break
+        a, b, pa, pb = a[differs], b[differs], pa[differs], pb[differs]
+        low = np.minimum(pa, pb)
+        np.minimum.at(parent, pa, low)
+        np.minimum.at(parent, pb, low)
+        # Pointer jumping until every item points at its root
+        while True:
+            grand = parent[parent]
+            if np.array_equal(grand, parent):
+                break
+            parent = grand
+    return parent
+
+def cluster_hashes(hashes, max_distance=4, valid=None, max_bucket_span=512):
+    # Groups hashes within max_distance bits of each other (transitively), returns one cluster
+    # label per hash: the index of the cluster's first member. Rows outside the `valid` mask
+    # (unreadable images) are left out and stay clusters of their own. Multi-index hashing: the 64 bits
+    # are split into max_distance + 1 chunks, and two hashes that close must agree exactly on at
+    # least one chunk, so only hashes sharing a chunk value are compared. Very large buckets
+    # (near-blank images) are compared against their max_bucket_span nearest sort neighbours.
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    if valid is not None:
+        rows = np.flatnonzero(valid)
+        labels = np.arange(len(hashes))
+        # Rows are increasing, so the first member of a sub-cluster is its first row overall
+        labels[rows] = rows[cluster_hashes(hashes[rows], max_distance, None, max_bucket_span)]
+        return labels
+    unique, inverse = np.unique(hashes, return_inverse=True)
+    num_chunks = max_distance + 1
+    edges_a, edges_b = [], []
+    bounds = np.linspace(0, 64, num_chunks + 1).astype(np.uint64)
+    for low, high in zip(bounds[:-1], bounds[1:]):
+        mask = np.uint64((1 << int(high - low)) - 1)
+        keys = (unique >> low) & mask
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        # Positions whose bucket still extends `step` rows further; keys are sorted, so once a
+        # position's neighbour at `step` is in another bucket so are all the farther ones
+        starts = np.arange(len(order))
+        for step in range(1, min(max_bucket_span, len(order))):
+            starts = starts[starts + step < len(order)]
+            starts = starts[sorted_keys[starts + step] == sorted_keys[starts]]
+            if not len(starts):
+                break
+            left, right = order[starts], order[starts + step]
+            close = popcount64(unique[left] ^ unique[right]) <= max_distance
+            edges_a.append(left[close])
+            edges_b.append(right[close])
+
+    a = np.concatenate(edges_a) if edges_a else np.zeros(0, dtype=np.int64)
+    b = np.concatenate(edges_b) if edges_b else np.zeros(0, dtype=np.int64)
+    unique_root = _union_find(len(unique), a, b)
+    # Identical hashes share their unique row; label clusters by their first image
+    roots = unique_root[inverse]
+    first = np.full(len(unique), len(hashes), dtype=np.int64)
+    np.minimum.at(first, roots, np.arange(len(hashes)))
+    return first[roots]
+
+
+class HashIndex:
+    # dHash of every image in one scanned directory, as a uint64 array in listing order next to
+    # the mtimes it was computed for, kept under index_dir. Updates re-hash only new or
+    # modified files, on the worker pool and in a background thread; until it finishes the
+    # previous hashes stay in use. Only a few chunks are queued on the pool at a time, so grid
+    # thumbnails submitted meanwhile are not stuck behind the whole directory's hashing.
+    # Clusters are cached per max_distance until the next update.
+
+    def __init__(self, root, index_dir, recursive=False):
+        index_dir = osp.abspath(osp.expanduser(index_dir))
+        os.makedirs(index_dir, exist_ok=True)
+        digest = hashlib.sha1(f"{osp.abspath(root)}|{recursive}".encode("utf-8")).hexdigest()
+        self.base_path = osp.join(index_dir, f"dhash_{digest}")
+        self.paths, self.mtimes, self.hashes = [], np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint64)
+        self.valid = np.zeros(0, dtype=bool)
+        self.progress = (0, 0)
+        self.last_update = None
+        self._thread = None
+        self._clusters = {}
+        self._lock = threading.Lock()
+        # paths.json is written last; indexes from before the validity mask are rebuilt
+        if osp.exists(self.base_path + ".paths.json") and osp.exists(self.base_path + ".valid.npy"):
+            with open(self.base_path + ".paths.json") as f:
+                self.paths = json.load(f)
+            self.mtimes = np.load(self.base_path + ".mtimes.npy")
+            self.hashes = np.load(self.base_path + ".hashes.npy")
+            self.valid = np.load(self.base_path + ".valid.npy")
+
+    def is_current(self, paths, mtimes):
+        return self.paths == paths and np.array_equal(self.mtimes, mtimes)
+
+    def is_updating(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def update_in_background(self, paths, mtimes, executor, max_distance=4, max_in_flight=2, chunk_size=8):
+        # Starts hashing the listing unless it is already hashed or being hashed; the clusters
+        # for max_distance are computed in the same thread. At most max_in_flight chunks of
+        # chunk_size images wait on the executor at once
+        with self._lock:
+            if self.is_updating() or self.is_current(paths, mtimes):
+                return
+            self._thread = threading.Thread(
+                target=self._update, args=(list(paths), np.asarray(mtimes), executor, max_distance, max_in_flight, chunk_size), daemon=True,
+            )
+            self._thread.start()
+
+    def _update(self, paths, mtimes, executor, max_distance, max_in_flight, chunk_size):
+        old_rows = {path: row for row, path in enumerate(self.paths)}
+        hashes = np.zeros(len(paths), dtype=np.uint64)
+        valid = np.zeros(len(paths), dtype=bool)
+        changed = []
+        for row, path in enumerate(paths):
+            old = old_rows.get(path)
+            if old is not None and self.mtimes[old] == mtimes[row]:
+                hashes[row], valid[row] = self.hashes[old], self.valid[old]
+            else:
+                changed.append(row)
+
+        self.progress = (0, len(changed))
+        chunks = iter([changed[i:i + chunk_size] for i in range(0, len(changed), chunk_size)])
+        in_flight = {}
+        done = 0
+        while True:
+            # Top up the queue as chunks finish, page thumbnails get in between
+            while len(in_flight) < max_in_flight:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                in_flight[executor.submit(dhash_many, [paths[row] for row in chunk])] = chunk
+            if not in_flight:
+                break
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                chunk = in_flight.pop(future)
+                hashes[chunk], valid[chunk] = future.result()
+                done += len(chunk)
+            self.progress = (done, len(changed))
+
+        for name, array in (("mtimes", mtimes), ("hashes", hashes), ("valid", valid)):
+            np.save(self.base_path + f".{name}.tmp.npy", array)
+            os.replace(self.base_path + f".{name}.tmp.npy", self.base_path + f".{name}.npy")
+        with open(self.base_path + ".paths.json.tmp", "w") as f:
+            json.dump(paths, f)
+        os.replace(self.base_path + ".paths.json.tmp", self.base_path + ".paths.json")
+        clusters = cluster_hashes(hashes, max_distance, valid)
+        with self._lock:
+            self.paths, self.mtimes, self.hashes, self.valid = paths, mtimes, hashes, valid
+            self._clusters = {max_distance: clusters}
+            self.last_update = time.time()
+
+    def clusters(self, max_distance=4):
+        # Cluster label per image of the current hashes, the index of its first member
+        with self._lock:
+            if max_distance not in self._clusters:
+                self._clusters[max_distance] = cluster_hashes(self.hashes, max_distance, self.valid)
+            return self._clusters[max_distance]
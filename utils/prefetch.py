@@ -0,0 +1,104 @@
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+
+
+def result_size(result):
+    # Rough in-memory size of a prepared grid cell: encoded bytes or a PIL image
+    if isinstance(result, (bytes, bytearray)):
+        return len(result)
+    if hasattr(result, "size") and hasattr(result, "getbands"):
+        return result.size[0] * result.size[1] * len(result.getbands())
+    return 0
+
+def completed_future(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+def submit_cached(executor, cache, make_key, fn, make_args):
+    # Future for fn(*make_args()) through `cache`. On a thread pool the key (a stat) and the
+    # cache read run in the task too, so queueing a page costs the script thread nothing per
+    # image. The cache lives in this process, with a process pool it is looked up here first
+    if isinstance(executor, ProcessPoolExecutor):
+        key = make_key()
+        data = cache.get(key)
+        if data is not None:
+            return completed_future(data)
+        future = executor.submit(fn, *make_args())
+        future.add_done_callback(lambda f: None if f.cancelled() or f.exception() else cache.put(key, f.result()))
+        return future
+
+    def task():
+        key = make_key()
+        data = cache.get(key)
+        if data is None:
+            data = fn(*make_args())
+            cache.put(key, data)
+        return data
+    return executor.submit(task)
+
+def _finished_size(futures):
+    return sum(result_size(f.result()) for f in futures if f.done() and not f.cancelled() and f.exception() is None)
+
+
+class PagePrefetcher:
+    # Keeps the grid cells of the pages around the current one in flight or ready.
+    # Each page holds its image list and one future per image. Pages are only valid for
+    # one settings key (directory, page size, resize and label settings...), a new key
+    # cancels everything. Pages outside the window around the current page are cancelled
+    # and dropped, and finished results are held within a memory budget, farthest page first.
+
+    def __init__(self, pages_each_side=1, memory_budget_bytes=256 * 1024 * 1024):
+        self.pages_each_side = pages_each_side
+        self.memory_budget_bytes = memory_budget_bytes
+        self.settings_key = None
+        self._pages = {}  # page -> (images, futures)
+        self._lock = threading.Lock()
+
+    def _drop(self, page):
+        _, futures = self._pages.pop(page, (None, []))
+        for future in futures:
+            future.cancel()
+
+    def configure(self, settings_key):
+        with self._lock:
+            if settings_key != self.settings_key:
+                for page in list(self._pages):
+                    self._drop(page)
+                self.settings_key = settings_key
+
+    def get_page(self, page, images, submit):
+        # Futures for `page`, reusing prefetched work; `submit(image)` returns a Future
+        with self._lock:
+            stored_images, futures = self._pages.get(page, (None, None))
+            if stored_images != images or any(f.cancelled() for f in futures):
+                # Page boundaries moved (page size or listing changed), the old work is useless
+                self._drop(page)
+                futures = [submit(image) for image in images]
+                self._pages[page] = (list(images), futures)
+            return futures
+
+    def focus(self, page):
+        # Cancel and drop the pages outside the window before the current page is queued
+        with self._lock:
+            for other in list(self._pages):
+                if abs(other - page) > self.pages_each_side:
+                    self._drop(other)
+
+            sizes = {other: _finished_size(futures) for other, (_, futures) in self._pages.items()}
+            total = sum(sizes.values())
+            for other in sorted(self._pages, key=lambda p: abs(p - page), reverse=True):
+                if total <= self.memory_budget_bytes or other == page:
+                    break
+                total -= sizes[other]
+                self._drop(other)
+
+    def prefetch(self, page, neighbours, submit):
+        # `neighbours` maps page number -> images of the pages to prepare next, nearest first
+        for other, images in sorted(neighbours.items(), key=lambda item: abs(item[0] - page)):
+            if other != page and abs(other - page) <= self.pages_each_side:
+                self.get_page(other, images, submit)
+
+    def memory_used(self):
+        with self._lock:
+            return sum(_finished_size(futures) for _, futures in self._pages.values())
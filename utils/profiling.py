@@ -0,0 +1,165 @@
+import os
+import json
+import time
+import uuid
+import threading
+import contextvars
+from collections import deque
+from contextlib import nullcontext
+import numpy as np
+import streamlit as st
+
+_DISABLED = nullcontext()
+# The Profiler of the session whose script run, or submitted task, is executing
+_current = contextvars.ContextVar("profiler", default=None)
+_log_lock = threading.Lock()
+
+
+class _Stage:
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Profiler:
+    # Per-stage wall time of one script or fragment run: `with profiler.stage("decode"): ...`
+    # around each stage, from any thread. Disabled, stage() hands back one shared no-op
+    # context manager, so instrumented code pays a function call and an attribute check.
+    # Finished runs are summarized (count, total, p50/p95 per stage), kept for the panel
+    # and optionally appended to a JSONL log. Work done in process-pool workers is not seen.
+    # Each Streamlit session has its own, see session_profiler().
+
+    def __init__(self, history=20):
+        self.enabled = False
+        self.log_path = None
+        self.session_id = uuid.uuid4().hex[:8]
+        self.runs = deque(maxlen=history)
+        self._current = None
+        self._lock = threading.Lock()
+
+    def stage(self, name):
+        if not self.enabled:
+            return _DISABLED
+        return _Stage(self, name)
+
+    def record(self, name, seconds):
+        with self._lock:
+            if self._current is not None:
+                self._current["stages"].setdefault(name, []).append(seconds)
+
+    def begin_run(self, kind):
+        # Returns False when profiling is off or a run is already open (a fragment
+        # drawn inside a full script run is part of that run)
+        with self._lock:
+            if not self.enabled or self._current is not None:
+                return False
+            self._current = {"kind": kind, "timestamp": time.time(), "start": time.perf_counter(), "stages": {}}
+            return True
+
+    def end_run(self):
+        with self._lock:
+            run, self._current = self._current, None
+        if run is None:
+            return None
+        summary = {
+            "session": self.session_id,
+            "kind": run["kind"],
+            "timestamp": run["timestamp"],
+            "wall_ms": (time.perf_counter() - run["start"]) * 1000,
+            "stages": {name: summarize_durations(durations) for name, durations in run["stages"].items()},
+        }
+        self.runs.append(summary)
+        if self.log_path:
+            log_path = os.path.expanduser(self.log_path)
+            os.makedirs(os.path.dirname(os.path.abspath(log_path)), exist_ok=True)
+            with _log_lock, open(log_path, "a") as f:
+                f.write(json.dumps(summary) + "\n")
+        return summary
+
+
+class CurrentProfiler:
+    # What the utils import as `profiler`: stages are recorded by the Profiler of the session
+    # that is running (see session_profiler()), in worker threads too when the task was
+    # submitted with that context. With no session profiler or profiling off, stage() is the
+    # shared no-op.
+
+    def stage(self, name):
+        current = _current.get()
+        if current is None or not current.enabled:
+            return _DISABLED
+        return _Stage(current, name)
+
+    def begin_run(self, kind):
+        current = _current.get()
+        return current.begin_run(kind) if current is not None else False
+
+    def end_run(self):
+        current = _current.get()
+        return current.end_run() if current is not None else None
+
+
+def session_profiler():
+    # The calling Streamlit session's Profiler, made current for this run and the tasks it
+    # submits. Called at the top of every script and fragment run
+    session = st.session_state.get("_profiler")
+    if session is None:
+        session = st.session_state["_profiler"] = Profiler()
+    _current.set(session)
+    return session
+
+def start_script_run(log_path=None):
+    # Top of an app script: the Profile Stages toggle sits at the bottom of the sidebar, its
+    # state is read here so the whole run is timed. Closes the previous run (a fragment rerun
+    # may have left one open) and returns the session's profiler
+    stage_profiler = session_profiler()
+    stage_profiler.enabled = st.session_state.get("profile_stages", False)
+    stage_profiler.log_path = log_path
+    stage_profiler.end_run()
+    stage_profiler.begin_run("script")
+    return stage_profiler
+
+def summarize_durations(durations):
+    durations = np.asarray(durations) * 1000
+    return {
+        "count": int(len(durations)),
+        "total_ms": float(durations.sum()),
+        "p50_ms": float(np.percentile(durations, 50)),
+        "p95_ms": float(np.percentile(durations, 95)),
+    }
+
+def show_profiling_panel(profiler):
+    # Sidebar expander with the recent runs, fragment reruns show up at the next full run
+    with st.sidebar.expander("⏱️ Stage Timings"):
+        if not profiler.runs:
+            st.caption("No runs recorded yet.")
+            return
+        runs = list(profiler.runs)[::-1]
+        selected = st.selectbox(
+            "Run", range(len(runs)),
+            format_func=lambda i: f"{time.strftime('%H:%M:%S', time.localtime(runs[i]['timestamp']))} · {runs[i]['kind']} · {runs[i]['wall_ms']:.0f} ms",
+        )
+        run = runs[selected]
+        # Stages on worker threads overlap, so totals can add up to more than the wall time
+        st.dataframe(
+            [
+                {"stage": name, "count": s["count"], "total ms": round(s["total_ms"], 1),
+                 "p50 ms": round(s["p50_ms"], 2), "p95 ms": round(s["p95_ms"], 2)}
+                for name, s in sorted(run["stages"].items(), key=lambda item: -item[1]["total_ms"])
+            ],
+            hide_index=True,
+        )
+        st.button("🔄 Refresh Timings")
+        if profiler.log_path:
+            st.caption(f"Appending runs to {profiler.log_path}")
+
+profiler = CurrentProfiler()
@@ -0,0 +1,153 @@
+import os
+import os.path as osp
+import json
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+
+from utils.annotation_utils import label_path_for
+from utils.profiling import profiler
+
+# A packed dataset is a directory holding shard_00000.bin, shard_00001.bin... with each image's
+# bytes followed by its label file's bytes, index.npy with one INDEX_DTYPE row per image and
+# names.json with the image paths relative to the source directory, in sorted order
+INDEX_DTYPE = np.dtype([("shard", "<i4"), ("offset", "<i8"), ("size", "<i8"), ("label_offset", "<i8"), ("label_size", "<i8")])
+INDEX_FILE = "index.npy"
+NAMES_FILE = "names.json"
+
+def shard_file(shard_dir, shard):
+    return osp.join(shard_dir, f"shard_{shard:05d}.bin")
+
+def is_shard_dir(path):
+    return osp.isfile(osp.join(path, INDEX_FILE)) and osp.isfile(osp.join(path, NAMES_FILE))
+
+def write_shards(image_paths, root, labels_dir, out_dir, shard_bytes=1024 * 1024 * 1024, progress=None):
+    # Packs `image_paths` (under `root`) and their YOLO label files into out_dir.
+    # Shards are filled sequentially and rolled over at shard_bytes; a label_size of -1 marks
+    # an image without a label file, so the displayers can tell it from an empty one
+    os.makedirs(out_dir, exist_ok=True)
+    image_paths = sorted(image_paths)
+    index = np.zeros(len(image_paths), dtype=INDEX_DTYPE)
+    shard, shard_size = 0, 0
+    out = open(shard_file(out_dir, shard), "wb")
+    try:
+        for row, image_path in enumerate(image_paths):
+            with open(image_path, "rb") as f:
+                image_data = f.read()
+            label_path = label_path_for(image_path, labels_dir) if labels_dir else None
+            label_data = None
+            if label_path and osp.exists(label_path):
+                with open(label_path, "rb") as f:
+                    label_data = f.read()
+
+            record_size = len(image_data) + len(label_data or b"")
+            if shard_size and shard_size + record_size > shard_bytes:
+                out.close()
+                shard, shard_size = shard + 1, 0
+                out = open(shard_file(out_dir, shard), "wb")
+            out.write(image_data)
+            label_offset = shard_size + len(image_data)
+            if label_data is not None:
+                out.write(label_data)
+            index[row] = (shard, shard_size, len(image_data), label_offset, -1 if label_data is None else len(label_data))
+            shard_size += record_size
+            if progress:
+                progress(row + 1, len(image_paths))
+    finally:
+        out.close()
+
+    # The index is written last, a half-written pack is never picked up as a dataset
+    with open(osp.join(out_dir, NAMES_FILE), "w") as f:
+        json.dump([osp.relpath(path, root) for path in image_paths], f)
+    tmp_path = osp.join(out_dir, INDEX_FILE + ".tmp.npy")
+    np.save(tmp_path, index)
+    os.replace(tmp_path, osp.join(out_dir, INDEX_FILE))
+    return index
+
+
+class ShardReader:
+    # Reads a packed dataset with the same count/page/all_paths interface as DirectoryScanner,
+    # with members named <shard_dir>/<relative path>. A read pulls in the block of block_rows
+    # images around the requested one (at most block_bytes) with one sequential read, and
+    # members are returned as memoryview slices of that block, without copying.
+    # Packs are immutable, re-packing replaces the index and needs a new reader.
+
+    def __init__(self, shard_dir, block_rows=64, block_bytes=16 * 1024 * 1024, cache_blocks=16):
+        self.shard_dir = shard_dir
+        self.index_path = osp.join(shard_dir, INDEX_FILE)
+        self.index = np.load(self.index_path, mmap_mode="r")
+        with open(osp.join(shard_dir, NAMES_FILE)) as f:
+            self.paths = [osp.join(shard_dir, name) for name in json.load(f)]
+        self.rows = {path: row for row, path in enumerate(self.paths)}
+        self.block_rows = block_rows
+        self.block_bytes = block_bytes
+        self.cache_blocks = cache_blocks
+        self.last_refresh = time.time()
+
+        self._blocks = OrderedDict()  # first row -> (stop row, file offset of the block, memoryview)
+        self._lock = threading.Lock()
+
+    def refresh(self, full=False):
+        return 0
+
+    def refresh_if_stale(self, max_age_s):
+        return 0
+
+    def count(self):
+        return len(self.paths)
+
+    def page(self, offset, limit):
+        return self.paths[int(offset):int(offset) + int(limit)]
+
+    def all_paths(self):
+        return list(self.paths)
+
+    def all_entries(self):
+        # Like DirectoryScanner.all_entries(); members carry the pack's mtime
+        mtime_ns = os.stat(self.index_path).st_mtime_ns
+        return list(self.paths), self.index["size"].astype(np.int64), np.full(len(self.paths), mtime_ns, dtype=np.int64)
+
+    def _load_block(self, row):
+        # Caller holds the lock. Blocks are aligned to block_rows so paging backwards reuses
+        # them too; rows are contiguous in their shard, so a block is one span of one file
+        first = row - row % self.block_rows
+        window = self.index[first:first + self.block_rows]
+        shard = int(self.index[row]["shard"])
+        in_shard = window["shard"] == shard
+        first += int(np.argmax(in_shard))
+        window = window[in_shard]
+        ends = window["offset"] + window["size"] + np.maximum(window["label_size"], 0)
+        start = int(window["offset"][0])
+        if ends[row - first] - start > self.block_bytes:
+            # Large files: start at the requested row and read forward up to block_bytes
+            window, ends = window[row - first:], ends[row - first:]
+            first, start = row, int(window["offset"][0])
+        fits = ends - start <= self.block_bytes
+        num_rows = len(window) if fits.all() else max(1, int(np.argmin(fits)))
+        stop_row, end = first + num_rows, int(ends[num_rows - 1])
+
+        with profiler.stage("shard read"), open(shard_file(self.shard_dir, shard), "rb") as f:
+            f.seek(start)
+            data = memoryview(f.read(end - start))
+        self._blocks[first] = (stop_row, start, data)
+        while len(self._blocks) > self.cache_blocks:
+            self._blocks.popitem(last=False)
+        return self._blocks[first]
+
+    def read(self, path):
+        # (image bytes, label bytes or None) as memoryviews into the cached block
+        row = self.rows[path]
+        with self._lock:
+            for first_row, block in self._blocks.items():
+                if first_row <= row < block[0]:
+                    self._blocks.move_to_end(first_row)
+                    break
+            else:
+                block = self._load_block(row)
+        _, base, data = block
+        record = self.index[row]
+        offset, size, label_offset, label_size = (int(record[field]) for field in ("offset", "size", "label_offset", "label_size"))
+        image = data[offset - base:offset - base + size]
+        label = data[label_offset - base:label_offset - base + label_size] if label_size >= 0 else None
+        return image, label
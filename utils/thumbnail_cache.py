@@ -0,0 +1,119 @@
+import os
+import os.path as osp
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+from utils.profiling import profiler
+
+
+class ThumbnailCache:
+    # Content-addressed on-disk cache of pre-sized, pre-encoded thumbnails.
+    # Entries are keyed by (path, mtime, size, target dimensions, encoding), so an
+    # edited file or a different display size never serves a stale thumbnail.
+    # The directory is bounded by `max_bytes`, least recently used entries go first.
+
+    def __init__(self, cache_dir, max_bytes=1024 * 1024 * 1024, fmt="WEBP", quality=85):
+        self.cache_dir = osp.abspath(osp.expanduser(cache_dir))
+        self.max_bytes = int(max_bytes)
+        self.fmt = fmt.upper()
+        self.quality = int(quality)
+        self.ext = ".jpg" if self.fmt == "JPEG" else "." + self.fmt.lower()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.total_bytes = 0
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> size in bytes, oldest first
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._load_entries()
+
+    def _load_entries(self):
+        # Rebuild the LRU order from the files left by previous sessions
+        found = []
+        for sub in os.scandir(self.cache_dir):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                if entry.name.endswith(self.ext):
+                    st = entry.stat()
+                    found.append((st.st_mtime_ns, entry.name[:-len(self.ext)], st.st_size))
+        found.sort()
+        for _, key, size in found:
+            self._entries[key] = size
+            self.total_bytes += size
+        self._evict()
+
+    def _entry_path(self, key):
+        return osp.join(self.cache_dir, key[:2], key + self.ext)
+
+    def make_key(self, path, target):
+        st = os.stat(path)
+        raw = f"{osp.abspath(path)}|{st.st_mtime_ns}|{st.st_size}|{target}|{self.fmt}|{self.quality}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path, "rb") as f, profiler.stage("cache read"):
+                data = f.read()
+            # Bump the mtime so the LRU order survives restarts
+            os.utime(entry_path)
+        except OSError:
+            with self._lock:
+                self.total_bytes -= self._entries.pop(key, 0)
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key, data):
+        entry_path = self._entry_path(key)
+        os.makedirs(osp.dirname(entry_path), exist_ok=True)
+        # Write to a temp file first so a concurrent reader never sees a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=osp.dirname(entry_path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, entry_path)
+        with self._lock:
+            self.total_bytes += len(data) - self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            self._evict()
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(self._entry_path(key))
+            except OSError:
+                pass
+
+    def get_or_create(self, path, target, make_fn):
+        # `make_fn` receives the image path and returns the encoded thumbnail bytes
+        key = self.make_key(path, target)
+        data = self.get(key)
+        if data is None:
+            data = make_fn(path)
+            self.put(key, data)
+        return data
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self.total_bytes,
+            }
@@ -0,0 +1,165 @@
+import os
+import os.path as osp
+import json
+import hashlib
+import threading
+import contextvars
+from math import ceil
+from collections import OrderedDict
+import numpy as np
+import cv2
+
+from utils.profiling import profiler
+
+
+class FrameServer:
+    # Keeps one cv2.VideoCapture open across Streamlit reruns and serves decoded RGB frames.
+    # Decoded frames are kept in an LRU, short forward hops are decoded with grab() instead of
+    # a keyframe seek, and stepping frame by frame triggers a sequential read-ahead in the
+    # background so the neighbouring frames are already decoded when the slider gets there.
+
+    def __init__(self, video_capture, cache_size=256, read_ahead=24, max_forward_grab=48):
+        self.capture = video_capture
+        self.total_frames = int(video_capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.cache_size = cache_size
+        self.read_ahead = read_ahead
+        self.max_forward_grab = max_forward_grab
+
+        self.position = 0  # index of the frame the next read() returns
+        self._frames = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_requested = None
+        self._generation = 0
+
+    def _store(self, frame_num, frame):
+        self._frames[frame_num] = frame
+        self._frames.move_to_end(frame_num)
+        while len(self._frames) > self.cache_size:
+            self._frames.popitem(last=False)
+
+    def _decode(self, frame_num):
+        # Caller holds the lock
+        # position is -1 after a failed read: the capture may be anywhere (often at EOF), seek
+        if self.position >= 0 and 0 <= frame_num - self.position <= self.max_forward_grab:
+            # Decoding forward a few frames is cheaper than seeking back to a keyframe
+            while self.position < frame_num:
+                if not self.capture.grab():
+                    return None
+                self.position += 1
+        elif frame_num != self.position:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, frame_num)
+            self.position = frame_num
+
+        ok, frame = self.capture.read()
+        if not ok:
+            # Position is unknown after a failed read, force a seek next time
+            self.position = -1
+            return None
+        self.position = frame_num + 1
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        self._store(frame_num, frame)
+        return frame
+
+    def get_frame(self, frame_num):
+        with self._lock:
+            step = None if self._last_requested is None else frame_num - self._last_requested
+            self._last_requested = frame_num
+            self._generation += 1
+            if frame_num in self._frames:
+                self._frames.move_to_end(frame_num)
+                frame = self._frames[frame_num]
+            else:
+                with profiler.stage("frame decode"):
+                    frame = self._decode(frame_num)
+
+        # Adjacent steps mean the user is scrubbing frame by frame, warm up the next frames
+        if step in (1, 2):
+            self._start_read_ahead(frame_num + 1, min(self.total_frames, frame_num + 1 + self.read_ahead))
+        elif step in (-1, -2):
+            self._start_read_ahead(max(0, frame_num - self.read_ahead), frame_num)
+        return frame
+
+    def _start_read_ahead(self, start, stop):
+        generation = self._generation
+        # Read-ahead decodes are timed for the session whose request started them
+        thread = threading.Thread(target=contextvars.copy_context().run, args=(self._read_ahead, start, stop, generation), daemon=True)
+        thread.start()
+
+    def _read_ahead(self, start, stop, generation):
+        for frame_num in range(start, stop):
+            # Take the lock per frame so a foreground request never waits for the whole window
+            with self._lock:
+                if generation != self._generation:
+                    return
+                if frame_num not in self._frames and self._decode(frame_num) is None:
+                    return
+
+    def release(self):
+        with self._lock:
+            self._generation += 1
+            self.capture.release()
+
+
+def preview_strip_path(video_path, cache_dir, every_n=30, tile_height=90):
+    st = os.stat(video_path)
+    raw = f"{osp.abspath(video_path)}|{st.st_mtime_ns}|{st.st_size}|{every_n}|{tile_height}"
+    return osp.join(osp.abspath(osp.expanduser(cache_dir)), hashlib.sha1(raw.encode("utf-8")).hexdigest() + ".npy")
+
+def build_preview_strip(video_path, cache_dir, every_n=30, tile_height=90):
+    # Samples every Nth frame once into a (num_samples, tile_height, tile_width, 3) uint8 .npy
+    # file, so the app can memory-map it and scrub without touching the decoder.
+    # The video is decoded in one sequential pass, no seeking.
+    strip_path = preview_strip_path(video_path, cache_dir, every_n, tile_height)
+    if osp.exists(strip_path):
+        return strip_path
+    os.makedirs(osp.dirname(strip_path), exist_ok=True)
+
+    capture = cv2.VideoCapture(video_path)
+    total_frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    width = int(capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    tile_width = max(1, round(width * tile_height / max(1, height)))
+    num_samples = max(1, ceil(total_frames / every_n))
+
+    tmp_path = strip_path + ".tmp.npy"
+    strip = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.uint8, shape=(num_samples, tile_height, tile_width, 3))
+    written = 0
+    frame_num = 0
+    try:
+        while written < num_samples and capture.grab():
+            if frame_num % every_n == 0:
+                ok, frame = capture.retrieve()
+                if not ok:
+                    break
+                frame = cv2.resize(frame, (tile_width, tile_height), interpolation=cv2.INTER_AREA)
+                strip[written] = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                written += 1
+            frame_num += 1
+    finally:
+        capture.release()
+    strip.flush()
+    del strip
+
+    # Frame counts from the container are estimates; rather than resizing the file, the number
+    # of tiles actually written goes to a sidecar and load_preview_strip cuts the black tail
+    with open(preview_strip_meta_path(strip_path), "w") as f:
+        json.dump({"video": osp.abspath(video_path), "every_n": every_n, "num_samples": written}, f)
+    os.replace(tmp_path, strip_path)
+    return strip_path
+
+def preview_strip_meta_path(strip_path):
+    return strip_path[:-len(".npy")] + ".json"
+
+def load_preview_strip(strip_path):
+    strip = np.load(strip_path, mmap_mode="r")
+    with open(preview_strip_meta_path(strip_path)) as f:
+        num_samples = json.load(f)["num_samples"]
+    return strip[:max(1, num_samples)]
+
+def make_filmstrip(strip, center, count=9):
+    # Row of `count` tiles around `center`, with the center tile framed
+    start = min(max(0, center - count // 2), max(0, len(strip) - count))
+    tiles = np.array(strip[start:start + count])
+    selected = center - start
+    tiles[selected, :3] = tiles[selected, -3:] = tiles[selected, :, :3] = tiles[selected, :, -3:] = (255, 64, 64)
+    return np.hstack(list(tiles))
@@ -2,9 +2,20 @@ import os
 import streamlit as st
 from datetime import timedelta
 import cv2
+from concurrent.futures import ThreadPoolExecutor
+from utils.video_utils import FrameServer, build_preview_strip, load_preview_strip, make_filmstrip
+from utils.profiling import profiler, start_script_run, show_profiling_panel
 
 # st.set_page_config(layout="wide")
 
+# Scrub previews: every Nth frame, downscaled to this height, cached per video on disk
+PREVIEW_CACHE_DIR = "~/.cache/sharingan/previews"
+PREVIEW_EVERY_N = 30
+PREVIEW_TILE_HEIGHT = 90
+
+# With Profile Stages on, each run's stage timings are also appended here as JSONL (None disables)
+PROFILE_LOG_PATH = None
+
 def capture_video_frames(video_path):
     # Open and Capture the video file
     return cv2.VideoCapture(video_path)
@@ -19,8 +30,29 @@ def get_video_info(video_capture):
 
     return fps, width, height
 
+@st.cache_resource(max_entries=8)
+def get_frame_server(video_path, mtime):
+    # One open capture per video (and version of it on disk), shared across reruns
+    video_capture = capture_video_frames(video_path)
+    return FrameServer(video_capture), get_video_info(video_capture)
+
+@st.cache_resource
+def get_preview_executor():
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="preview")
+
+@st.cache_resource(max_entries=256)
+def request_preview_strip(video_path, mtime):
+    # The future is cached too, so every rerun sees the same background job
+    return get_preview_executor().submit(build_preview_strip, video_path, PREVIEW_CACHE_DIR, PREVIEW_EVERY_N, PREVIEW_TILE_HEIGHT)
+
+def jump_to_frame(frame_num):
+    st.session_state.frame_num = frame_num
+
 def main():
 
+    # Timings are kept per session, other reviewers on the same server are not affected
+    stage_profiler = start_script_run(PROFILE_LOG_PATH)
+
     # Sidebar for folder path input
     folder_path = st.sidebar.text_input("Input Videos Directory Path:")
     st.session_state.folder_path = folder_path
@@ -30,7 +62,8 @@ def main():
     
     else:
         # Get list of video files in the folder
-        video_files = [file for file in os.listdir(folder_path) if file.endswith((".mp4", ".avi"))]
+        with profiler.stage("directory scan"):
+            video_files = [file for file in os.listdir(folder_path) if file.endswith((".mp4", ".avi"))]
         video_files.sort()
         if len(video_files) == 0:
             st.error(f"No videos found in: {folder_path}.")
@@ -45,19 +78,37 @@ def main():
             
             # Read the selected video file
             video_path = os.path.join(folder_path, selected_video)
-            video_capture = capture_video_frames(video_path)
+            frame_server, (fps, width, height) = get_frame_server(video_path, os.path.getmtime(video_path))
             
-            total_frames = int(video_capture.get(cv2.CAP_PROP_FRAME_COUNT))
-            frame_num = st.slider("Select Frame No.:", 0, total_frames - 1, 0)
+            total_frames = frame_server.total_frames
+
+            # Coarse scrubbing runs on the memory-mapped preview strip, only the frame
+            # finally selected below goes through the decoder
+            preview_job = request_preview_strip(video_path, os.path.getmtime(video_path))
+            if preview_job.done() and preview_job.exception() is None:
+                strip = load_preview_strip(preview_job.result())
+                preview_index = st.slider("Scrub Preview:", 0, max(1, len(strip) - 1), 0, key="preview_index")
+                preview_index = min(preview_index, len(strip) - 1)
+                with profiler.stage("filmstrip"):
+                    filmstrip = make_filmstrip(strip, preview_index)
+                with profiler.stage("st.image"):
+                    st.image(filmstrip, caption=f"Around frame {preview_index * PREVIEW_EVERY_N}")
+                st.button("🎯 Show Exact Frame", on_click=jump_to_frame, args=(min(preview_index * PREVIEW_EVERY_N, total_frames - 1),))
+            elif preview_job.done():
+                st.caption(f"Scrub preview unavailable: {preview_job.exception()}")
+            else:
+                st.caption("Building scrub preview in the background...")
+
+            if st.session_state.get("frame_num", 0) > total_frames - 1:
+                st.session_state.frame_num = 0
+            st.session_state.setdefault("frame_num", 0)
+            frame_num = st.slider("Select Frame No.:", 0, total_frames - 1, key="frame_num")
 
             # Get video information
             video_name = os.path.basename(video_path)
-            fps, width, height = get_video_info(video_capture)
 
             # Display video frames
-            video_capture.set(cv2.CAP_PROP_POS_FRAMES, frame_num)
-            _, frame = video_capture.read()
-            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            frame = frame_server.get_frame(frame_num)
             
             # Calculate the total duration of the video in seconds
             total_duration_seconds = total_frames / fps
@@ -74,15 +125,23 @@ def main():
             else:
                 st.write(f":stopwatch:    {str(elapsed_minutes)} : {str(elapsed_seconds)}")
 
-            st.image(frame, caption= f"{video_name}")
+            if frame is None:
+                st.error(f"Could not decode frame {frame_num} of {video_name}")
+            else:
+                with profiler.stage("st.image"):
+                    st.image(frame, caption= f"{video_name}")
             # st.write(f"Current Frame: {frame_num}")
-            # Release the video capture object
-            video_capture.release()
 
             # Display additional information
             # st.sidebar.write(f"Video Name: {video_name}")
             st.sidebar.write(f"FPS: {fps}")
             st.sidebar.write(f"Resolution: {width} x {height}")
 
+    st.sidebar.divider()
+    st.sidebar.toggle("Profile Stages", key="profile_stages", help="Time each stage of a run: scan, frame decode, transfer.")
+    stage_profiler.end_run()
+    if stage_profiler.enabled:
+        show_profiling_panel(stage_profiler)
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
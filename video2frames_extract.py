@@ -0,0 +1,132 @@
+# Bulk frame extraction, one worker process per video.
+#   python video2frames_extract.py --videos data/videos --out data/frames --every-n 10
+#   python video2frames_extract.py --videos data/videos --out data/frames --interval-s 0.5
+# Frames land in <out>/<name>_<ext>/<name>_<ext>_<frame>.jpg (clip.mp4 -> clip_mp4/), which image_displayer shows
+# with Recursive Search on. Videos already extracted with the same settings are skipped.
+import os
+import os.path as osp
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import cv2
+
+from video2frames_displayer import capture_video_frames, get_video_info
+
+VIDEO_EXTENSIONS = (".mp4", ".avi")
+DONE_MARKER = ".extracted.json"
+
+def output_name(video_path):
+    # Keeps the extension, clip.mp4 and clip.avi would otherwise share one output directory
+    stem, ext = osp.splitext(osp.basename(video_path))
+    return f"{stem}_{ext[1:]}" if ext else stem
+
+def extract_frames(video_path, out_dir, every_n=1, interval_s=None, fmt="jpg", quality=95):
+    # Decodes the video front to back: grab() every frame, retrieve() only the sampled ones,
+    # so there is no seek at all. Returns (frames written, frames decoded, seconds)
+    start = time.perf_counter()
+    name = output_name(video_path)
+    video_dir = osp.join(out_dir, name)
+    os.makedirs(video_dir, exist_ok=True)
+    # Frames from an earlier run with other settings would mix with the new ones
+    for file_name in os.listdir(video_dir):
+        if file_name == DONE_MARKER or (file_name.startswith(name + "_") and file_name.endswith((".jpg", ".png"))):
+            os.remove(osp.join(video_dir, file_name))
+
+    video_capture = capture_video_frames(video_path)
+    fps, width, height = get_video_info(video_capture)
+    # get_video_info rounds the rate down, time-based sampling needs the exact one (29.97...)
+    exact_fps = video_capture.get(cv2.CAP_PROP_FPS) or fps
+    params = [cv2.IMWRITE_JPEG_QUALITY, quality] if fmt == "jpg" else []
+
+    written = 0
+    frame_num = 0
+    next_sample = 0.0  # frame position of the next time-based sample
+    try:
+        while video_capture.grab():
+            if interval_s:
+                take = frame_num >= next_sample
+                if take:
+                    next_sample += interval_s * exact_fps
+            else:
+                take = frame_num % every_n == 0
+            if take:
+                ok, frame = video_capture.retrieve()
+                if not ok:
+                    break
+                cv2.imwrite(osp.join(video_dir, f"{name}_{frame_num:06d}.{fmt}"), frame, params)
+                written += 1
+            frame_num += 1
+    finally:
+        video_capture.release()
+
+    # Written last, so an interrupted video is extracted again on the next run
+    with open(osp.join(video_dir, DONE_MARKER), "w") as f:
+        json.dump({"video": osp.abspath(video_path), "mtime_ns": os.stat(video_path).st_mtime_ns,
+                   "every_n": every_n, "interval_s": interval_s, "format": fmt,
+                   "fps": exact_fps, "width": width, "height": height, "frames": frame_num, "written": written}, f)
+    return written, frame_num, time.perf_counter() - start
+
+def is_extracted(video_path, out_dir, every_n, interval_s, fmt):
+    marker = osp.join(out_dir, output_name(video_path), DONE_MARKER)
+    try:
+        with open(marker) as f:
+            done = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return (done.get("mtime_ns") == os.stat(video_path).st_mtime_ns and done.get("every_n") == every_n
+            and done.get("interval_s") == interval_s and done.get("format") == fmt)
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract frames from every video in a directory")
+    parser.add_argument("--videos", required=True, help="Directory with .mp4/.avi files")
+    parser.add_argument("--out", required=True, help="Output root, one subdirectory per video")
+    sampling = parser.add_mutually_exclusive_group()
+    sampling.add_argument("--every-n", type=int, default=1, help="Keep every Nth frame")
+    sampling.add_argument("--interval-s", type=float, default=None, help="Keep one frame every this many seconds")
+    parser.add_argument("--format", choices=["jpg", "png"], default="jpg")
+    parser.add_argument("--quality", type=int, default=95, help="JPEG quality")
+    parser.add_argument("--num-workers", type=int, default=0, help="Videos decoded in parallel, 0 uses one per CPU core")
+    parser.add_argument("--overwrite", action="store_true", help="Extract again even if a video was already done")
+    args = parser.parse_args()
+
+    video_files = sorted(file for file in os.listdir(args.videos) if file.endswith(VIDEO_EXTENSIONS))
+    video_paths = [osp.join(args.videos, file) for file in video_files]
+    every_n = max(1, args.every_n)
+    pending = [
+        path for path in video_paths
+        if args.overwrite or not is_extracted(path, args.out, every_n, args.interval_s, args.format)
+    ]
+    print(f"{len(video_paths)} videos, {len(video_paths) - len(pending)} already extracted, {len(pending)} to go")
+
+    num_workers = args.num_workers if args.num_workers > 0 else (os.cpu_count() or 1)
+    start = time.perf_counter()
+    total_written = total_decoded = 0
+    failed = 0
+    # Each worker decodes a whole video; OpenCV's own threads would oversubscribe the cores
+    with ProcessPoolExecutor(max_workers=min(num_workers, max(1, len(pending))), initializer=cv2.setNumThreads, initargs=(1,)) as executor:
+        futures = {
+            executor.submit(extract_frames, path, args.out, every_n, args.interval_s, args.format, args.quality): path
+            for path in pending
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            path = futures[future]
+            try:
+                written, decoded, seconds = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"[{done}/{len(pending)}] {osp.basename(path)}: failed: {e}", file=sys.stderr)
+                continue
+            total_written += written
+            total_decoded += decoded
+            print(f"[{done}/{len(pending)}] {osp.basename(path)}: {written} frames written, "
+                  f"{decoded} decoded in {seconds:.1f}s ({decoded / max(seconds, 1e-9):.0f} fps)")
+
+    elapsed = time.perf_counter() - start
+    print(f"Done: {total_written} frames from {len(pending) - failed} videos in {elapsed:.1f}s, "
+          f"{total_decoded / max(elapsed, 1e-9):.0f} frames/s decoded overall")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())